@@ -0,0 +1,138 @@
+"""
+Download throughput against the local Special:Export stub server, so that
+results are reproducible and need no network access.
+
+Compares, for the same set of pages:
+  - one history= request per page (download_page_w_revisions), which the
+    server truncates at 1000 revisions just like Wikipedia,
+  - the paginated downloader, one page after another,
+  - the range-partitioned downloader, time ranges of each page in parallel,
+  - the async downloader, all pages concurrently.
+
+The server runs in its own process so it does not compete with the
+downloaders for the GIL.
+
+Run from the repository root:
+    python -m benchmarks.bench_download --pages 8 --revisions 3000 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from benchmarks.export_stub_server import StubExportServer
+from download_wiki_revisions_async import download_all
+from download_wiki_revisions_language import (
+    count_revisions_in_xml,
+    download_page_w_revisions,
+)
+from utils.export_client import download_history, download_history_parallel
+
+
+def single_request(pages: list[str], base_url: str, _: Path) -> int:
+    return sum(
+        count_revisions_in_xml(download_page_w_revisions(page, "en", base_url=base_url))
+        for page in pages
+    )
+
+
+def paginated(pages: list[str], base_url: str, save_dir: Path) -> int:
+    return sum(download_history(page, save_dir, base_url=base_url) for page in pages)
+
+
+def range_parallel(pages: list[str], base_url: str, save_dir: Path) -> int:
+    return sum(
+        download_history_parallel(page, save_dir, base_url=base_url) for page in pages
+    )
+
+
+def concurrent(pages: list[str], base_url: str, save_dir: Path) -> int:
+    results = asyncio.run(
+        download_all([(page, "en") for page in pages], save_dir, base_url=base_url)
+    )
+    return sum(result for result in results.values() if isinstance(result, int))
+
+
+def _serve(port: int, server_options: dict) -> None:
+    StubExportServer(port=port, **server_options).serve_forever()
+
+
+def start_server(server_options: dict, titles: list[str]) -> tuple:
+    """Starts a stub server process and waits until every page is generated."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = multiprocessing.Process(
+        target=_serve, args=(port, server_options), daemon=True
+    )
+    process.start()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(base_url + "/stats", timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    for title in titles:
+        requests.post(
+            base_url + "/w/index.php",
+            data={"title": "Special:Export", "pages": title},
+            timeout=60,
+        )
+    return process, base_url
+
+
+def served_requests(base_url: str) -> int:
+    return json.loads(requests.get(base_url + "/stats", timeout=5).text)["requests"]
+
+
+def main(pages: int, revisions: int, latency: float, error_rate: float) -> None:
+    titles = [f"Benchmark_page_{i}" for i in range(pages)]
+    print(
+        f"{pages} pages x {revisions} revisions, {latency * 1000:.0f} ms latency, "
+        f"{error_rate:.0%} errors"
+    )
+    server_options = {
+        "revisions": revisions,
+        "latency": latency,
+        "error_rate": error_rate,
+    }
+    runs = [
+        ("single request", single_request),
+        ("paginated", paginated),
+        ("range parallel", range_parallel),
+        ("async concurrent", concurrent),
+    ]
+    for name, func in runs:
+        process, base_url = start_server(server_options, titles)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                before = served_requests(base_url)
+                start = time.perf_counter()
+                count = func(titles, base_url, Path(tmp))
+                elapsed = time.perf_counter() - start
+            made = served_requests(base_url) - before
+        finally:
+            process.terminate()
+        print(
+            f"{name:18s} {elapsed:7.2f} s  {count:7d} revisions  "
+            f"{count / elapsed:8.0f} revisions/s  {made:4d} requests  "
+            f"{elapsed / made * 1000:6.0f} ms/request"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--revisions", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    main(args.pages, args.revisions, args.latency, args.error_rate)
@@ -0,0 +1,62 @@
+"""
+Compares revisions/sec of the BeautifulSoup splitter (parse the export, then
+re-parse every revision twice in construct_path) with the single-pass lxml
+record splitter.
+
+Run from the repository root:
+    python -m benchmarks.bench_revision_splitter --revisions 50000
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from benchmarks.synthetic_export import export_document
+from download_wiki_revisions_language import construct_path, parse_mediawiki_revisions
+from utils.export_stream import iter_revision_records
+from utils.revision_store import revision_path
+
+SAVE_DIR = Path("data")
+PAGE = "Benchmark_page"
+
+
+def split_with_beautifulsoup(document: bytes) -> int:
+    count = 0
+    for wiki_revision in parse_mediawiki_revisions(document.decode("utf-8")):
+        construct_path(page_name=PAGE, save_dir=SAVE_DIR, wiki_revision=wiki_revision)
+        count += 1
+    return count
+
+
+def split_with_records(document: bytes, chunk_size: int = 8192) -> int:
+    chunks = (document[i : i + chunk_size] for i in range(0, len(document), chunk_size))
+    count = 0
+    for record in iter_revision_records(chunks):
+        revision_path(record, page_name=PAGE, save_dir=SAVE_DIR)
+        count += 1
+    return count
+
+
+def main(revisions: int, skip_before: bool) -> None:
+    document = export_document(PAGE, revisions)
+    print(f"{revisions} revisions, {len(document) / 1e6:.1f} MB of export XML")
+    runs = [("after (lxml records)", split_with_records)]
+    if not skip_before:
+        runs.insert(0, ("before (BeautifulSoup)", split_with_beautifulsoup))
+    for name, func in runs:
+        start = time.perf_counter()
+        count = func(document)
+        elapsed = time.perf_counter() - start
+        print(f"{name:24s} {elapsed:8.2f} s  {count / elapsed:10.0f} revisions/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--revisions", type=int, default=50_000)
+    parser.add_argument(
+        "--skip-before",
+        action="store_true",
+        help="Only time the new splitter (the old one takes minutes at 50k)",
+    )
+    args = parser.parse_args()
+    main(args.revisions, args.skip_before)
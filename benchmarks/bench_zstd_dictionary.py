@@ -0,0 +1,101 @@
+"""
+Compares the on-disk size and read throughput of the revision codecs on real
+page histories: the text columns of DataFrames written with --include-text
+are turned back into export XML, written oldest first with write_revision
+and read back with iter_month_revisions, as xml_to_dataframe does. With
+zstd-dict the first revisions are written before the page has a dictionary,
+exactly as in a download.
+
+Run from the repository root:
+    python -m benchmarks.bench_zstd_dictionary DataFrames/Oblast*.feather
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic_export import (
+    EXPORT_FOOTER,
+    EXPORT_HEADER,
+    page_xml,
+    sha1_base36,
+)
+from utils.export_stream import RevisionRecord, iter_revision_records
+from utils.revision_store import iter_month_revisions, month_dirs, write_revision
+from utils.zstd_dictionary import _dictionaries
+
+CODECS = ("none", "gzip", "zstd", "zstd-dict")
+PAGE = "Benchmark_page"
+
+
+def _field(value: object, default: object) -> object:
+    return default if pd.isna(value) else value
+
+
+def feather_records(path: Path) -> list[RevisionRecord]:
+    """The revisions of a DataFrame as export records, oldest first."""
+    df = pd.read_feather(path).sort_values(["timestamp", "revision_id"])
+    revisions = [
+        {
+            "id": row.revision_id,
+            "parentid": None,
+            "timestamp": row.timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "username": _field(row.username, ""),
+            "userid": _field(row.userid, 0),
+            "comment": _field(row.comment, ""),
+            "text": row.text,
+            "sha1": sha1_base36(row.text),
+        }
+        for row in df.itertuples()
+    ]
+    document = EXPORT_HEADER + page_xml(PAGE, 1, revisions) + EXPORT_FOOTER
+    return list(iter_revision_records([document.encode("utf-8")]))
+
+
+def read_page(page_dir: Path) -> int:
+    """Reads every revision of a page; returns the bytes of XML read."""
+    return sum(
+        len(xml)
+        for month_dir in month_dirs(page_dir)
+        for _, xml in iter_month_revisions(month_dir)
+    )
+
+
+def bench_page(path: Path, repeat: int) -> None:
+    records = feather_records(path)
+    size = sum(len(record.xml) for record in records)
+    print(f"{path.name}: {len(records)} revisions, {size / 1e6:.1f} MB of XML")
+    for codec in CODECS:
+        with tempfile.TemporaryDirectory() as tmp:
+            save_dir = Path(tmp)
+            start = time.perf_counter()
+            for record in records:
+                write_revision(record, PAGE, save_dir, codec=codec)
+            write_time = time.perf_counter() - start
+            page_dir = save_dir / PAGE
+            stored = sum(
+                file.stat().st_size for file in page_dir.rglob("*") if file.is_file()
+            )
+            best = float("inf")
+            for _ in range(repeat):
+                _dictionaries.clear()  # load the dictionary as a fresh run would
+                start = time.perf_counter()
+                read_page(page_dir)
+                best = min(best, time.perf_counter() - start)
+        print(
+            f"  {codec:10s} {stored / 1e6:8.2f} MB  {size / stored:6.1f}x"
+            f"  write {len(records) / write_time:7.0f} rev/s"
+            f"  read {size / best / 1e6:6.0f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", type=Path, help="Feather files")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for feather_path in args.paths:
+        bench_page(feather_path, args.repeat)
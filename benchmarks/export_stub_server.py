@@ -0,0 +1,401 @@
+"""
+A local stand-in for MediaWiki's Special:Export, for offline download
+benchmarks.
+
+Serves /w/index.php?title=Special:Export and /wiki/Special:Export/<title>
+with the `pages` (several titles separated by newlines), `history`, `limit`,
+`offset` and `dir` parameters, from generated histories or from export XML
+fixtures, and /w/api.php for action=query with prop=revisions (with
+rvcontinue) or prop=info (JSON, formatversion=2). Exports carry an ETag
+and conditional requests with a matching If-None-Match get a 304. Latency, throttling (429 with
+Retry-After) and random 503 errors can be injected. GET /stats reports how
+many requests were served.
+
+Run from the repository root:
+    python -m benchmarks.export_stub_server --port 8080 --revisions 5000
+and point a downloader at it with --base-url http://127.0.0.1:8080
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from lxml import etree
+
+from benchmarks.synthetic_export import (
+    EXPORT_FOOTER,
+    EXPORT_HEADER,
+    iter_revisions,
+    page_xml,
+    sha1_base36,
+)
+
+EXPORT_LIMIT = 1000
+API_LIMIT = 500
+MISSING_PREFIX = "Missing_"
+
+
+def load_fixture(path: Path) -> list[dict]:
+    """Reads the revisions of an export XML file into revision dicts."""
+    revisions = []
+    for _, element in etree.iterparse(path, tag="{*}revision", huge_tree=True):
+        text = element.findtext("{*}text") or ""
+        revisions.append(
+            {
+                "id": int(element.findtext("{*}id")),
+                "parentid": element.findtext("{*}parentid"),
+                "timestamp": element.findtext("{*}timestamp"),
+                "username": element.findtext("{*}contributor/{*}username") or "",
+                "userid": element.findtext("{*}contributor/{*}id") or 0,
+                "comment": element.findtext("{*}comment") or "",
+                "text": text,
+                "sha1": element.findtext("{*}sha1") or sha1_base36(text),
+            }
+        )
+        element.clear()
+    return sorted(revisions, key=lambda revision: revision["timestamp"])
+
+
+class StubWiki:
+    """The page histories a stub server answers from, generated on first use."""
+
+    def __init__(self, revisions: int = 2000, fixtures: Path | None = None):
+        self.revisions = revisions
+        self.fixtures = fixtures
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def history(self, title: str) -> list[dict] | None:
+        """All revisions of a page, oldest first, or None if it does not exist."""
+        title = title.replace(" ", "_")
+        with self._lock:
+            if title not in self._pages:
+                self._pages[title] = self._build(title)
+            return self._pages[title]
+
+    def _build(self, title: str) -> list[dict] | None:
+        if self.fixtures is not None:
+            path = self.fixtures / f"{title}.xml"
+            return load_fixture(path) if path.exists() else None
+        if title.startswith(MISSING_PREFIX):
+            return None
+        seed = zlib.crc32(title.encode("utf-8"))
+        first_id = 1000 + seed % 1000 * self.revisions
+        return list(iter_revisions(self.revisions, seed=seed, first_id=first_id))
+
+    def page_id(self, title: str) -> int:
+        return zlib.crc32(title.replace(" ", "_").encode("utf-8")) % 10_000_000
+
+
+def select_revisions(history: list[dict], params: dict) -> list[dict]:
+    """Applies the export's history/limit/offset/dir parameters to a history."""
+    if "history" not in params and "limit" not in params:
+        return history[-1:]
+    direction = params.get("dir", "asc")
+    offset = params.get("offset")
+    limit = min(int(params.get("limit") or EXPORT_LIMIT), EXPORT_LIMIT)
+    if direction == "desc":
+        selected = [
+            r for r in reversed(history) if not offset or r["timestamp"] < offset
+        ]
+    else:
+        selected = [r for r in history if not offset or r["timestamp"] > offset]
+    return selected[:limit]
+
+
+def _continue_key(revision: dict) -> str:
+    timestamp = revision["timestamp"].translate(str.maketrans("", "", "-T:Z"))
+    return f"{timestamp}|{revision['id']}"
+
+
+def api_revision(revision: dict) -> dict:
+    """A revision dict as action=query&prop=revisions returns it."""
+    return {
+        "revid": revision["id"],
+        "parentid": int(revision["parentid"] or 0),
+        "user": revision["username"],
+        "userid": int(revision["userid"]),
+        "timestamp": revision["timestamp"],
+        "size": len(revision["text"].encode("utf-8")),
+        "sha1": revision["sha1"],
+        "comment": revision["comment"],
+    }
+
+
+def query_revisions(history: list[dict], params: dict) -> tuple[list[dict], dict]:
+    """
+    Applies rvdir/rvlimit/rvcontinue to a history. Returns the selected
+    revisions and the continuation to send back (empty when done).
+    """
+    newer = params.get("rvdir", "older") == "newer"
+    ordered = history if newer else history[::-1]
+    cont = params.get("rvcontinue")
+    if cont:
+        cont_time, _, cont_id = cont.partition("|")
+        start = (cont_time, int(cont_id))
+
+        def keep(revision: dict) -> bool:
+            time, _, revid = _continue_key(revision).partition("|")
+            key = (time, int(revid))
+            return key >= start if newer else key <= start
+
+        ordered = [r for r in ordered if keep(r)]
+    limit = params.get("rvlimit", "10")
+    limit = API_LIMIT if limit == "max" else min(int(limit), API_LIMIT)
+    if len(ordered) > limit:
+        cont = {"rvcontinue": _continue_key(ordered[limit]), "continue": "||"}
+        return ordered[:limit], cont
+    return ordered, {}
+
+
+class TokenBucket:
+    """Server-side throttle: requests beyond `rate` per second get a 429."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class ExportRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubExportServer"
+
+    def do_GET(self) -> None:
+        self._handle(dict(parse_qsl(urlsplit(self.path).query, keep_blank_values=True)))
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        params = dict(parse_qsl(urlsplit(self.path).query, keep_blank_values=True))
+        params.update(parse_qsl(body, keep_blank_values=True))
+        self._handle(params)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+    def _handle(self, params: dict) -> None:
+        server = self.server
+        path = unquote(urlsplit(self.path).path)
+        if path == "/stats":
+            self._send(200, json.dumps({"requests": server.requests}).encode("utf-8"))
+            return
+        server.count_request()
+        if server.latency:
+            time.sleep(server.latency)
+        if server.bucket is not None and not server.bucket.take():
+            self._send(429, b"Too many requests", {"Retry-After": "1"})
+            return
+        if server.error_rate and server.rng.random() < server.error_rate:
+            self._send(503, b"Service unavailable")
+            return
+
+        if path == "/w/api.php":
+            self._send(200, self._api(params), {"Content-Type": "application/json"})
+            return
+        if path.startswith("/wiki/Special:Export/"):
+            titles = [path.removeprefix("/wiki/Special:Export/")]
+        elif path == "/w/index.php" and params.get("title") == "Special:Export":
+            titles = [t for t in params.get("pages", "").splitlines() if t.strip()]
+        else:
+            self._send(404, b"Not found")
+            return
+        body = self._export(titles, params)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, b"", {"ETag": etag})
+            return
+        self._send(200, body, {"Content-Type": "application/xml", "ETag": etag})
+
+    def _export(self, titles: list[str], params: dict) -> bytes:
+        wiki = self.server.wiki
+        pages = []
+        for title in titles:
+            history = wiki.history(title)
+            if history is not None:
+                revisions = select_revisions(history, params)
+                pages.append(
+                    page_xml(title.replace("_", " "), wiki.page_id(title), revisions)
+                )
+        return (EXPORT_HEADER + "".join(pages) + EXPORT_FOOTER).encode("utf-8")
+
+    def _api(self, params: dict) -> bytes:
+        if params.get("action") == "query" and params.get("prop") == "info":
+            return self._page_info(params)
+        if params.get("action") != "query" or params.get("prop") != "revisions":
+            error = {"code": "badparams", "info": "Only prop=revisions/info is served"}
+            return json.dumps({"error": error}).encode("utf-8")
+        wiki = self.server.wiki
+        title = params.get("titles", "").replace("_", " ")
+        history = wiki.history(title)
+        if history is None:
+            pages = [{"ns": 0, "title": title, "missing": True}]
+            return json.dumps({"query": {"pages": pages}}).encode("utf-8")
+        revisions, cont = query_revisions(history, params)
+        page = {
+            "pageid": wiki.page_id(title),
+            "ns": 0,
+            "title": title,
+            "revisions": [api_revision(revision) for revision in revisions],
+        }
+        data = {"batchcomplete": True, "query": {"pages": [page]}}
+        if cont:
+            data["continue"] = cont
+        return json.dumps(data).encode("utf-8")
+
+    def _page_info(self, params: dict) -> bytes:
+        wiki = self.server.wiki
+        query = {"pages": []}
+        for given in params.get("titles", "").split("|"):
+            title = given.replace("_", " ")
+            if title != given:
+                query.setdefault("normalized", []).append({"from": given, "to": title})
+            history = wiki.history(title)
+            if history is None:
+                query["pages"].append({"ns": 0, "title": title, "missing": True})
+            else:
+                query["pages"].append(
+                    {
+                        "pageid": wiki.page_id(title),
+                        "ns": 0,
+                        "title": title,
+                        "lastrevid": history[-1]["id"],
+                        "length": len(history[-1]["text"].encode("utf-8")),
+                    }
+                )
+        return json.dumps({"batchcomplete": True, "query": query}).encode("utf-8")
+
+    def _send(self, status: int, body: bytes, headers: dict | None = None) -> None:
+        accepts_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        if self.server.compress and accepts_gzip and status != 304:
+            body = gzip.compress(body, compresslevel=1)
+            headers = {**(headers or {}), "Content-Encoding": "gzip"}
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubExportServer(ThreadingHTTPServer):
+    """
+    The stub server. Use it as a context manager to serve from a background
+    thread, e.g. inside a benchmark:
+
+        with StubExportServer(revisions=5000, latency=0.05) as server:
+            download_history("Page", save_dir, base_url=server.base_url)
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        revisions: int = 2000,
+        fixtures: Path | None = None,
+        latency: float = 0.0,
+        throttle_rps: float | None = None,
+        error_rate: float = 0.0,
+        compress: bool = True,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), ExportRequestHandler)
+        self.wiki = StubWiki(revisions, fixtures)
+        self.latency = latency
+        self.bucket = TokenBucket(throttle_rps) if throttle_rps else None
+        self.error_rate = error_rate
+        self.compress = compress
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count_request(self) -> None:
+        with self._count_lock:
+            self.requests += 1
+
+    def handle_error(
+        self, request: socket.socket, client_address: tuple[str, int]
+    ) -> None:
+        # Clients that hang up mid-response are not server errors
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def __enter__(self) -> "StubExportServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve Special:Export responses locally",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--revisions", type=int, default=2000, help="Revisions per generated page"
+    )
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        help="Directory of <title>.xml exports to serve instead of generated pages",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per request"
+    )
+    parser.add_argument(
+        "--throttle-rps", type=float, help="Answer 429 above this many requests/sec"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with 503",
+    )
+    parser.add_argument(
+        "--no-gzip", action="store_true", help="Never compress responses"
+    )
+    args = parser.parse_args()
+    server = StubExportServer(
+        port=args.port,
+        revisions=args.revisions,
+        fixtures=args.fixtures,
+        latency=args.latency,
+        throttle_rps=args.throttle_rps,
+        error_rate=args.error_rate,
+        compress=not args.no_gzip,
+    )
+    print(f"Serving Special:Export on {server.base_url}")
+    server.serve_forever()
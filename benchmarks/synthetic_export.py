@@ -0,0 +1,132 @@
+"""Deterministic, realistic-looking Special:Export documents for benchmarks."""
+
+import hashlib
+import random
+from collections.abc import Generator
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+EXPORT_HEADER = (
+    '<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.11/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'version="0.11" xml:lang="en">\n'
+    "  <siteinfo>\n    <sitename>Wikipedia</sitename>\n"
+    "    <dbname>enwiki</dbname>\n  </siteinfo>\n"
+)
+EXPORT_FOOTER = "</mediawiki>\n"
+
+VOCABULARY = """
+the of and in to a is was for on as by with from that at his which it an were
+are this be or also has had first its new after their who other oblast region
+administrative city district population government river [[Ukraine]] [[Russia]]
+[[Soviet_Union]] {{cite_web}} <ref> </ref> '''bold''' ==History== ==Geography==
+==Economy== ==Demographics== [[Category:Regions]]
+"""
+WORDS = VOCABULARY.split()
+
+
+def sha1_base36(text: str) -> str:
+    """The sha1 of a text in the base-36 form MediaWiki puts in exports."""
+    value = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while value:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+    return out.rjust(31, "0")
+
+
+def _line(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30)))
+
+
+def iter_revisions(
+    n_revisions: int,
+    seed: int = 0,
+    first_id: int = 1000,
+    start: datetime = datetime(2004, 1, 1),
+    text_lines: int = 20,
+) -> Generator[dict, None, None]:
+    """
+    Yields revision dicts in chronological order. Each revision edits a few
+    lines of the previous text, and roughly one in twenty reverts to the text
+    two revisions back, which is what real article histories look like.
+    """
+    rng = random.Random(seed)
+    lines = [_line(rng) for _ in range(text_lines)]
+    history = []
+    timestamp = start
+    for i in range(n_revisions):
+        if len(history) >= 2 and rng.random() < 0.05:
+            lines = list(history[-2])
+        else:
+            for _ in range(rng.randint(1, 3)):
+                action = rng.random()
+                pos = rng.randrange(len(lines) + 1)
+                if action < 0.6 and pos < len(lines):
+                    lines[pos] = _line(rng)
+                elif len(lines) < text_lines or (
+                    action < 0.8 and len(lines) < 2 * text_lines
+                ):
+                    lines.insert(pos, _line(rng))
+                else:
+                    del lines[min(pos, len(lines) - 1)]
+        history = [*history[-1:], list(lines)]
+        # About one edit in ten lands in the same second as the previous one,
+        # as bot edits and quick reverts do
+        if rng.random() >= 0.1:
+            timestamp += timedelta(seconds=rng.randint(60, 12 * 3600))
+        text = "\n".join(lines)
+        user = rng.randint(1, 500)
+        yield {
+            "id": first_id + i,
+            "parentid": first_id + i - 1 if i else None,
+            "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "username": f"Editor{user}",
+            "userid": user,
+            "comment": _line(rng)[:80],
+            "text": text,
+            "sha1": sha1_base36(text),
+        }
+
+
+def revision_xml(revision: dict) -> str:
+    """Serialises a revision dict the way Special:Export does."""
+    parent = (
+        f"      <parentid>{revision['parentid']}</parentid>\n"
+        if revision["parentid"]
+        else ""
+    )
+    text = revision["text"]
+    return (
+        "    <revision>\n"
+        f"      <id>{revision['id']}</id>\n{parent}"
+        f"      <timestamp>{revision['timestamp']}</timestamp>\n"
+        "      <contributor>\n"
+        f"        <username>{escape(revision['username'])}</username>\n"
+        f"        <id>{revision['userid']}</id>\n"
+        "      </contributor>\n"
+        f"      <comment>{escape(revision['comment'])}</comment>\n"
+        "      <model>wikitext</model>\n      <format>text/x-wiki</format>\n"
+        f'      <text bytes="{len(text.encode("utf-8"))}" xml:space="preserve">'
+        f"{escape(text)}</text>\n"
+        f"      <sha1>{revision['sha1']}</sha1>\n"
+        "    </revision>\n"
+    )
+
+
+def page_xml(title: str, page_id: int, revisions: list[dict]) -> str:
+    """Serialises one <page> with the given revisions."""
+    body = "".join(revision_xml(revision) for revision in revisions)
+    return (
+        f"  <page>\n    <title>{escape(title)}</title>\n    <ns>0</ns>\n"
+        f"    <id>{page_id}</id>\n{body}  </page>\n"
+    )
+
+
+def export_document(title: str, n_revisions: int, seed: int = 0) -> bytes:
+    """A complete export of one page with n_revisions revisions."""
+    revisions = list(iter_revisions(n_revisions, seed=seed))
+    return (EXPORT_HEADER + page_xml(title, 1, revisions) + EXPORT_FOOTER).encode(
+        "utf-8"
+    )
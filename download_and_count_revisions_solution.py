@@ -1,17 +1,39 @@
 import argparse
-from collections.abc import Callable, Generator
-from datetime import datetime
+from collections.abc import Generator
+from datetime import datetime, timedelta
 from pathlib import Path
 
-import requests
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
-DATA_DIR = Path("data")
-
+from utils.export_client import WIKI_URL, download_batch, download_history, export_url
+from utils.export_stream import format_timestamp
+from utils.http_cache import CACHE_DIR_NAME, HttpCache
+from utils.http_session import get_session
+from utils.mediawiki_api import last_revision_ids
+from utils.revision_store import (
+    CODECS,
+    LAYOUTS,
+    TEXT_STORES,
+    StoredRevision,
+    count_page_revisions,
+    find_first_revision,
+    find_last_revision,
+)
 
-def download_page_w_revisions(page_title: str, limit: int = 100) -> str:
-    base_url = "https://en.wikipedia.org/w/index.php"
+DATA_DIR = Path("data")
+BATCH_SIZE = 50
+
+
+def download_page_w_revisions(
+    page_title: str | list[str],
+    limit: int = 100,
+    base_url: str = WIKI_URL,
+    cache: HttpCache | None = None,
+) -> str:
+    # Several titles go into one request, one per line
+    if not isinstance(page_title, str):
+        page_title = "\n".join(page_title)
     params = {
         "title": "Special:Export",
         "pages": page_title,
@@ -19,7 +41,9 @@ def download_page_w_revisions(page_title: str, limit: int = 100) -> str:
         "dir": "desc",
         "action": "submit",
     }
-    response = requests.post(base_url, data=params)
+    if cache is not None:
+        return cache.content("POST", export_url("en", base_url), data=params).decode()
+    response = get_session().post(export_url("en", base_url), data=params)
     response.raise_for_status()
     return response.text
 
@@ -68,59 +92,207 @@ def construct_path(page_name: str, save_dir: Path, wiki_revision: str) -> Path:
 
 
 def count_revisions(revisions_dir: Path) -> int:
-    return sum(1 for _ in revisions_dir.rglob("*.xml"))
-
-
-def _extract_yearmonth(path: Path) -> str:
-    return f"{path.parent.parent.name}-{path.parent.name}"
+    # Answered by the revision index, which relists only months that changed
+    return count_page_revisions(revisions_dir)
 
 
-def _find_yearmonth_with_func(revisions_dir: Path, sort_func: Callable) -> str:
-    return _extract_yearmonth(sort_func(revisions_dir.rglob("*.xml")))
+def _extract_yearmonth(stored: StoredRevision) -> str:
+    return f"{stored.timestamp.year}-{stored.timestamp.month:02d}"
 
 
 def find_first_revision_yearmonth(revisions_dir: Path) -> str:
-    return _find_yearmonth_with_func(revisions_dir, min)
+    return _extract_yearmonth(find_first_revision(revisions_dir))
 
 
 def find_last_revision_yearmonth(revisions_dir: Path) -> str:
-    return _find_yearmonth_with_func(revisions_dir, max)
+    return _extract_yearmonth(find_last_revision(revisions_dir))
+
+
+def download_revisions(
+    page: str,
+    limit: int,
+    data_dir: Path,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    cache: HttpCache | None = None,
+) -> None:
+    # Paginates past the 1000-revision cap of a single export request and
+    # resumes from the last checkpoint if an earlier run was interrupted
+    downloaded = download_history(
+        page,
+        save_dir=data_dir,
+        max_revisions=limit,
+        direction="desc",
+        codec=codec,
+        layout=layout,
+        text_store=text_store,
+        cache=cache,
+    )
+    print(f"Downloaded {downloaded} revisions. Done!")
+
+
+def download_revisions_batched(
+    pages: list[str],
+    limit: int,
+    data_dir: Path,
+    batch_size: int = BATCH_SIZE,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    cache: HttpCache | None = None,
+) -> None:
+    """Downloads the newest revisions of many pages, batch_size pages per request."""
+    for i in range(0, len(pages), batch_size):
+        batch = pages[i : i + batch_size]
+        counts = download_batch(
+            batch,
+            data_dir,
+            max_revisions=limit,
+            direction="desc",
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            cache=cache,
+        )
+        for page in batch:
+            if page not in counts:
+                print(f"Page {page} does not exist")
+    print(f"Downloaded {len(pages)} pages in batches of {batch_size}. Done!")
+
+
+def update_revisions(
+    page: str,
+    data_dir: Path,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+) -> None:
+    """Downloads only the revisions newer than the newest one already stored."""
+    newest = find_last_revision(data_dir / page)
+    if newest is None:
+        print(f"No stored revisions of {page} to update from.")
+        return
+    print(
+        f"Fetching revisions of {page} newer than {newest.revision_id} ({newest.timestamp})"
+    )
+    downloaded = download_history(
+        page,
+        save_dir=data_dir,
+        direction="asc",
+        # Offsets are exclusive and whole seconds, so start a second early
+        # to get revisions made in the same second as the newest one
+        offset=format_timestamp(newest.timestamp - timedelta(seconds=1)),
+        seen=[newest.revision_id],
+        codec=codec,
+        layout=layout,
+        text_store=text_store,
+    )
+    print(f"Downloaded {downloaded} new revisions. Done!")
 
 
-def download_revisions(page: str, limit: int, data_dir: Path) -> None:
-    raw_revisions = download_page_w_revisions(page, limit=limit)
-    validate_page(page, page_xml=raw_revisions)
-    print("Downloaded revisions. Parsing and saving...")
-    for wiki_revision in tqdm(parse_mediawiki_revisions(raw_revisions), total=limit):
-        revision_path = construct_path(
-            wiki_revision=wiki_revision, page_name=page, save_dir=data_dir
-        )
-        if not revision_path.exists():
-            revision_path.parent.mkdir(parents=True, exist_ok=True)
-        revision_path.write_text(wiki_revision)
-    print("Done!")
+def changed_pages(pages: list[str], data_dir: Path) -> list[str]:
+    """
+    The stored pages whose current revision on Wikipedia is not the newest
+    one on disk. A single API request checks 50 pages.
+    """
+    last_ids = last_revision_ids(pages)
+    changed = []
+    for page in pages:
+        newest = find_last_revision(data_dir / page)
+        if newest is None or last_ids.get(page) != int(newest.revision_id):
+            changed.append(page)
+    return changed
 
 
 def validate_page(page_name: str, page_xml: str) -> None:
-    try:
-        _ = _extract_attribute(page_xml, attribute="page")
-    except ValueError:
+    # Missing pages come back as an export without any <page> element
+    if "<page>" not in page_xml:
         raise ValueError(f"Page {page_name} does not exist")
 
 
-def main(page: str, limit: int, data_dir: Path, update: bool = False):
+def main(
+    page: str,
+    limit: int,
+    data_dir: Path,
+    update: bool = False,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    use_cache: bool = True,
+):
     """
     Downloads the main page (with revisions) for the given page title.
     Organizes the revisions into a folder structure like
     <page_name>/<year>/<month>/<revision_id>.xml
+
+    If use_cache is True, the export requests go through an HTTP cache in
+    <data_dir>/.http_cache, so re-running on the same page is served locally.
+    Updates always ask Wikipedia.
     """
     print(f"Downloading {limit} revisions of {page} to {data_dir}")
     page_directory = data_dir / page
-    if not update and (page_directory).exists():
-        print(f"Page {page} already exists. Skipping download.")
+    if not page_directory.exists():
+        download_revisions(
+            page,
+            limit,
+            data_dir,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            cache=HttpCache(data_dir / CACHE_DIR_NAME) if use_cache else None,
+        )
+    elif update:
+        update_revisions(
+            page, data_dir, codec=codec, layout=layout, text_store=text_store
+        )
     else:
-        download_revisions(page, limit, data_dir)
+        print(f"Page {page} already exists. Skipping download.")
+    print_page_summary(page, page_directory)
+
+
+def main_batch(
+    pages: list[str],
+    limit: int,
+    data_dir: Path,
+    update: bool = False,
+    batch_size: int = BATCH_SIZE,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    use_cache: bool = True,
+) -> None:
+    """
+    Like main for many pages at once: pages not downloaded yet are fetched
+    batch_size titles per export request instead of one request each.
+    """
+    missing = [page for page in pages if not (data_dir / page).exists()]
+    print(f"Downloading {limit} revisions of {len(missing)} pages to {data_dir}")
+    if update:
+        stored = [page for page in pages if page not in missing]
+        changed = changed_pages(stored, data_dir)
+        print(f"{len(stored) - len(changed)} of {len(stored)} pages are up to date")
+        for page in changed:
+            update_revisions(
+                page, data_dir, codec=codec, layout=layout, text_store=text_store
+            )
+    if missing:
+        download_revisions_batched(
+            missing,
+            limit,
+            data_dir,
+            batch_size,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            cache=HttpCache(data_dir / CACHE_DIR_NAME) if use_cache else None,
+        )
+    for page in pages:
+        if (data_dir / page).exists():
+            print_page_summary(page, data_dir / page)
+
 
+def print_page_summary(page: str, page_directory: Path) -> None:
     revision_count = count_revisions(page_directory)
     max_yearmonth = find_last_revision_yearmonth(page_directory)
     min_yearmonth = find_first_revision_yearmonth(page_directory)
@@ -134,7 +306,10 @@ if __name__ == "__main__":
         description="Download Wikipedia page revisions",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
-    parser.add_argument("page", type=str, help="Title of the Wikipedia page")
+    parser.add_argument("pages", nargs="*", help="Titles of the Wikipedia pages")
+    parser.add_argument(
+        "--pages-file", type=Path, help="File with one page title per line"
+    )
     parser.add_argument(
         "--limit",
         type=int,
@@ -142,7 +317,68 @@ if __name__ == "__main__":
         help="Number of revisions to download",
     )
     parser.add_argument(
-        "--update", action="store_true", help="Should new data be updated?"
+        "--update",
+        action="store_true",
+        help="Fetch only revisions newer than the newest stored one",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=CODECS,
+        default="none",
+        help="Compression for the stored revision files",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="files",
+        help="Store one file per revision, or one segment file per month",
+    )
+    parser.add_argument(
+        "--text-store",
+        choices=TEXT_STORES,
+        default="inline",
+        help="Keep texts in the revision XML, once per distinct text under "
+        "<data-dir>/.blobs, or as deltas with periodic keyframes per page",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Pages per export request when downloading several pages",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Serve repeated exports from the HTTP cache in data/.http_cache",
     )
     args = parser.parse_args()
-    main(page=args.page, limit=args.limit, data_dir=DATA_DIR, update=args.update)
+    pages = list(args.pages)
+    if args.pages_file:
+        lines = args.pages_file.read_text(encoding="utf-8").splitlines()
+        pages += [line.strip() for line in lines if line.strip()]
+    if not pages:
+        parser.error("give at least one page or --pages-file")
+    if len(pages) == 1:
+        main(
+            page=pages[0],
+            limit=args.limit,
+            data_dir=DATA_DIR,
+            update=args.update,
+            codec=args.codec,
+            layout=args.layout,
+            text_store=args.text_store,
+            use_cache=args.cache,
+        )
+    else:
+        main_batch(
+            pages,
+            limit=args.limit,
+            data_dir=DATA_DIR,
+            update=args.update,
+            batch_size=args.batch_size,
+            codec=args.codec,
+            layout=args.layout,
+            text_store=args.text_store,
+            use_cache=args.cache,
+        )
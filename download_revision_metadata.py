@@ -0,0 +1,83 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from tqdm import tqdm
+
+from utils.export_client import WIKI_URL
+from utils.mediawiki_api import iter_revision_metadata, metadata_row
+from xml_to_dataframe import build_dataframe, print_summary
+
+OUTPUT_DIR = Path("DataFrames")
+
+
+def download_metadata(
+    page: str,
+    lang: str = "en",
+    max_revisions: int | None = None,
+    base_url: str = WIKI_URL,
+) -> pd.DataFrame:
+    """
+    The revision history of a page as a DataFrame with the xml_to_dataframe
+    columns, fetched from the action API without downloading any wikitext.
+    """
+    revisions = iter_revision_metadata(
+        page, lang, max_revisions=max_revisions, base_url=base_url
+    )
+    rows = [
+        metadata_row(revision)
+        for revision in tqdm(revisions, desc=f"Fetching {page}", unit="rev")
+    ]
+    return build_dataframe([pd.DataFrame(rows)])
+
+
+def main(
+    pages: list[str],
+    output_dir: Path,
+    lang: str = "en",
+    max_revisions: int | None = None,
+    base_url: str = WIKI_URL,
+) -> None:
+    """
+    Writes one Feather file of revision metadata per page. Use this instead
+    of downloading and converting the XML when the text itself is not needed.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for page in pages:
+        df = download_metadata(page, lang, max_revisions, base_url)
+        df.to_feather(output_dir / f"{page}.feather")
+        print_summary(df, page, include_text=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download Wikipedia revision metadata (no text) into DataFrames",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("pages", nargs="+", help="Titles of the Wikipedia pages")
+    parser.add_argument(
+        "--lang", type=str, default="en", help="Language of the Wikipedia pages"
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=OUTPUT_DIR,
+        help="Directory to save DataFrame files",
+    )
+    parser.add_argument(
+        "--limit", type=int, help="Only fetch this many of the newest revisions"
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=WIKI_URL,
+        help="Wiki to download from; {lang} is replaced by the language code",
+    )
+    args = parser.parse_args()
+    main(
+        args.pages,
+        output_dir=args.output_dir,
+        lang=args.lang,
+        max_revisions=args.limit,
+        base_url=args.base_url,
+    )
@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from lxml import etree
+from tqdm import tqdm
+
+from utils.export_client import (
+    EXPORT_LIMIT,
+    WIKI_URL,
+    Continuation,
+    checkpoint_batch,
+    clear_checkpoint,
+    export_params,
+    export_url,
+    resume_state,
+)
+from utils.export_stream import read_revision_records, revision_parser
+from utils.http_session import async_client, send_with_retries
+from utils.rate_limit import AdaptiveRateLimiter, get_rate_limiter
+from utils.revision_store import CODECS, LAYOUTS, TEXT_STORES, write_revision
+
+DATA_DIR = Path("data")
+CONNECTIONS_PER_HOST = 4
+MAX_CONNECTIONS = 32
+
+
+def _save_completed(
+    parser: etree.XMLPullParser,
+    continuation: Continuation,
+    page: str,
+    lang: str,
+    save_dir: Path,
+    codec: str,
+    layout: str,
+    text_store: str,
+) -> tuple[int, int]:
+    """
+    Writes the revisions the parser has completed so far. Returns how many
+    were received and how many of them were new.
+    """
+    received = 0
+    new = 0
+    for record in read_revision_records(parser):
+        received += 1
+        if not continuation.is_new(record):
+            continue
+        write_revision(
+            record,
+            page_name=page,
+            save_dir=save_dir,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            lang=lang,
+        )
+        new += 1
+    return received, new
+
+
+async def download_history_async(
+    client: httpx.AsyncClient,
+    page: str,
+    lang: str,
+    save_dir: Path,
+    host_slots: asyncio.Semaphore,
+    progress: tqdm,
+    base_url: str = WIKI_URL,
+    batch_size: int = EXPORT_LIMIT,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    limiter: AdaptiveRateLimiter | None = None,
+) -> int:
+    """
+    Async counterpart of utils.export_client.download_history: pages through
+    the full history of one page, writing revisions as they stream in and
+    checkpointing after every batch. Each request holds one of the host's
+    connection slots only while it is in flight. Revisions and checkpoints
+    are written in a worker thread, so disk I/O does not block the other
+    downloads.
+    """
+    page_dir = save_dir / page
+    resumed = resume_state(page_dir, "asc", None)
+    continuation, downloaded = resumed or (Continuation(), 0)
+    url = export_url(lang, base_url)
+    while True:
+        limit = batch_size + len(continuation.seen)
+        params = export_params(page, limit, offset=continuation.offset)
+        received = 0
+        new = 0
+        async with host_slots:
+            response = await send_with_retries(
+                client, "POST", url, limiter=limiter, data=params
+            )
+            try:
+                response.raise_for_status()
+                parser = revision_parser()
+                async for chunk in response.aiter_bytes():
+                    parser.feed(chunk)
+                    counts = await asyncio.to_thread(
+                        _save_completed,
+                        parser,
+                        continuation,
+                        page,
+                        lang,
+                        save_dir,
+                        codec,
+                        layout,
+                        text_store,
+                    )
+                    received += counts[0]
+                    new += counts[1]
+            finally:
+                await response.aclose()
+            parser.close()
+            counts = await asyncio.to_thread(
+                _save_completed,
+                parser,
+                continuation,
+                page,
+                lang,
+                save_dir,
+                codec,
+                layout,
+                text_store,
+            )
+            received += counts[0]
+            new += counts[1]
+        progress.update(new)
+        if received == 0 and downloaded == 0 and continuation.offset is None:
+            raise ValueError(f"Page {page} does not exist")
+        if new == 0:
+            break
+
+        downloaded += new
+        continuation.advance()
+        await asyncio.to_thread(
+            checkpoint_batch, page_dir, continuation, downloaded, None
+        )
+        if received < min(limit, EXPORT_LIMIT):
+            break
+
+    await asyncio.to_thread(clear_checkpoint, page_dir)
+    return downloaded
+
+
+def _host(lang: str, base_url: str) -> str:
+    return urlsplit(export_url(lang, base_url)).netloc
+
+
+async def download_all(
+    pairs: list[tuple[str, str]],
+    save_dir: Path,
+    connections_per_host: int = CONNECTIONS_PER_HOST,
+    max_connections: int = MAX_CONNECTIONS,
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    limiter: AdaptiveRateLimiter | None = None,
+) -> dict[tuple[str, str], int | BaseException]:
+    """
+    Downloads the histories of many (page, lang) pairs concurrently over one
+    pooled, retrying client. Requests to each host are capped at
+    connections_per_host and paced by the shared adaptive rate limiter.
+
+    Returns the number of revisions per pair, or the exception it failed with.
+    """
+    limiter = limiter or get_rate_limiter()
+    host_slots = {}
+    for _, lang in pairs:
+        host_slots.setdefault(
+            _host(lang, base_url), asyncio.Semaphore(connections_per_host)
+        )
+
+    async with async_client(max_connections) as client:
+        with tqdm(desc="Downloading revisions", unit="rev") as progress:
+            results = await asyncio.gather(
+                *(
+                    download_history_async(
+                        client,
+                        page,
+                        lang,
+                        save_dir,
+                        host_slots[_host(lang, base_url)],
+                        progress,
+                        base_url=base_url,
+                        codec=codec,
+                        layout=layout,
+                        text_store=text_store,
+                        limiter=limiter,
+                    )
+                    for page, lang in pairs
+                ),
+                return_exceptions=True,
+            )
+    return dict(zip(pairs, results, strict=True))
+
+
+def read_pairs(path: Path, default_lang: str) -> list[tuple[str, str]]:
+    """Reads one page per line, optionally followed by a tab and a language code."""
+    pairs = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        page, _, lang = line.strip().partition("\t")
+        pairs.append((page, lang or default_lang))
+    return pairs
+
+
+def main(
+    pairs: list[tuple[str, str]],
+    data_dir: Path,
+    connections_per_host: int = CONNECTIONS_PER_HOST,
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+) -> None:
+    """
+    Downloads the complete histories of all pages concurrently into the
+    <page>/<year>/<month>/<revision_id>.xml layout.
+    """
+    results = asyncio.run(
+        download_all(
+            pairs,
+            data_dir,
+            connections_per_host=connections_per_host,
+            base_url=base_url,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+        )
+    )
+    for (page, lang), result in results.items():
+        if isinstance(result, BaseException):
+            print(f"{lang}:{page} failed: {result}")
+        else:
+            print(f"{lang}:{page} downloaded {result} revisions")
+    for host, stats in get_rate_limiter().stats().items():
+        print(
+            f"{host}: {stats.requests} requests at {stats.achieved:.2f}/s, "
+            f"{stats.throttled} throttled, now allowed {stats.rate:.2f}/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download the revision histories of many Wikipedia pages concurrently",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("pages", nargs="*", help="Titles of the Wikipedia pages")
+    parser.add_argument(
+        "--pages-file",
+        type=Path,
+        help="File with one page per line, optionally followed by a tab and a language code",
+    )
+    parser.add_argument(
+        "--lang",
+        type=str,
+        default="en",
+        help="Language of pages given without one",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=DATA_DIR,
+        help="Directory to store the revision data",
+    )
+    parser.add_argument(
+        "--connections-per-host",
+        type=int,
+        default=CONNECTIONS_PER_HOST,
+        help="Maximum concurrent requests to each Wikipedia host",
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=WIKI_URL,
+        help="Wiki to download from; {lang} is replaced by the language code",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=CODECS,
+        default="none",
+        help="Compression for the stored revision files",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="files",
+        help="Store one file per revision, or one segment file per month",
+    )
+    parser.add_argument(
+        "--text-store",
+        choices=TEXT_STORES,
+        default="inline",
+        help="Keep texts in the revision XML, once per distinct text under "
+        "<data-dir>/.blobs, or as deltas with periodic keyframes per page",
+    )
+    args = parser.parse_args()
+    pairs = [(page, args.lang) for page in args.pages]
+    if args.pages_file:
+        pairs += read_pairs(args.pages_file, args.lang)
+    main(
+        pairs,
+        data_dir=args.data_dir,
+        connections_per_host=args.connections_per_host,
+        base_url=args.base_url,
+        codec=args.codec,
+        layout=args.layout,
+        text_store=args.text_store,
+    )
@@ -2,22 +2,48 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 import requests
+from collections.abc import Generator, Iterable
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+from utils.export_client import WIKI_URL, download_history, download_history_parallel
+from utils.export_stream import RevisionRecord, iter_revision_records
+from utils.http_cache import CACHE_DIR_NAME, HttpCache
+from utils.http_session import get_session
+from utils.revision_store import CODECS, LAYOUTS, TEXT_STORES, stored_month_counts, write_revision
+
 DATA_DIR = Path("data")
 
-def download_page_w_revisions(page_title: str, lang:str) -> str:
-    """Downloads complete revision history of a page using Special:Export with progress bar."""
-    url = f"https://{lang}.wikipedia.org/wiki/Special:Export/{page_title}"
+def _export_request_args(page_title: str, lang: str, base_url: str = WIKI_URL) -> tuple[str, dict]:
+    """URL and parameters of a Special:Export request for the complete history of a page."""
+    url = base_url.format(lang=lang) + f"/wiki/Special:Export/{page_title}"
     params = {
         "history": "",  # Empty parameter to get full history
         "action": "submit"
     }
-    
-    # Make initial request to get content length
-    response = requests.get(url, params=params, stream=True)
+    return url, params
+
+def _request_export(page_title: str, lang: str, base_url: str = WIKI_URL) -> requests.Response:
+    """Opens a streaming Special:Export request for the complete history of a page."""
+    url, params = _export_request_args(page_title, lang, base_url)
+    response = get_session().get(url, params=params, stream=True)
     response.raise_for_status()
+    return response
+
+def _export_chunks(page_title: str, lang: str, base_url: str = WIKI_URL, cache: HttpCache | None = None) -> Iterable[bytes]:
+    """The raw export, through the HTTP cache when one is given."""
+    if cache is not None:
+        url, params = _export_request_args(page_title, lang, base_url)
+        return cache.iter_content("GET", url, params=params)
+    return _request_export(page_title, lang, base_url).iter_content(chunk_size=8192)
+
+def download_page_w_revisions(page_title: str, lang:str, base_url: str = WIKI_URL, cache: HttpCache | None = None) -> str:
+    """Downloads complete revision history of a page using Special:Export with progress bar."""
+    if cache is not None:
+        return b''.join(_export_chunks(page_title, lang, base_url, cache)).decode('utf-8')
+
+    # Make initial request to get content length
+    response = _request_export(page_title, lang, base_url)
     
     # Get total size if available
     total_size = int(response.headers.get('content-length', 0))
@@ -35,21 +61,41 @@ def download_page_w_revisions(page_title: str, lang:str) -> str:
     content = []
     for data in response.iter_content(chunk_size=8192):
         content.append(data)
-        progress.update(len(data))
+        # content-length counts the (possibly compressed) bytes on the wire
+        progress.update(response.raw.tell() - progress.n)
     
     progress.close()
     
     return b''.join(content).decode('utf-8')
 
+def stream_page_revisions(page_title: str, lang: str, base_url: str = WIKI_URL, cache: HttpCache | None = None) -> Generator[RevisionRecord, None, None]:
+    """
+    Streams the revision history of a page from Special:Export.
+
+    Downloaded chunks go straight into an incremental XML parser and each
+    revision is yielded as soon as its closing tag arrives, so neither the raw
+    response nor a parsed tree of the whole history is ever held in memory.
+    """
+    found = False
+    for record in iter_revision_records(_export_chunks(page_title, lang, base_url, cache)):
+        found = True
+        yield record
+    if not found:
+        raise ValueError(f"Page {page_title} does not exist")
+
 def parse_mediawiki_revisions(xml_content):
     soup = BeautifulSoup(xml_content, "lxml-xml")
     for revision in soup.find_all("revision"):
         yield str(revision)
 
 def count_revisions_in_xml(xml_content: str) -> int:
-    """Count the number of revisions in a single XML response."""
-    soup = BeautifulSoup(xml_content, "lxml-xml")
-    return len(soup.find_all("revision"))
+    """
+    Count the number of revisions in a single XML response.
+
+    A substring scan is exact here: markup inside wikitext is escaped in the
+    export, so every "<revision>" is a real opening tag.
+    """
+    return xml_content.count("<revision>")
 
 def count_stored_revisions(page_name: str, data_dir: Path) -> dict:
     """
@@ -73,24 +119,11 @@ def count_stored_revisions(page_name: str, data_dir: Path) -> dict:
         'by_year_month': {}
     }
     
-    # Walk through the directory structure
-    for year_dir in sorted(page_dir.iterdir()):
-        if not year_dir.is_dir():
-            continue
-            
-        year = year_dir.name
-        counts['by_year'][year] = 0
-        
-        for month_dir in sorted(year_dir.iterdir()):
-            if not month_dir.is_dir():
-                continue
-                
-            month = month_dir.name
-            revision_count = len(list(month_dir.glob("*.xml")))
-            
-            counts['by_year'][year] += revision_count
-            counts['by_year_month'][(year, month)] = revision_count
-            counts['total'] += revision_count
+    # Answered by the revision index, which relists only months that changed
+    for (year, month), revision_count in stored_month_counts(page_dir).items():
+        counts['by_year'][year] = counts['by_year'].get(year, 0) + revision_count
+        counts['by_year_month'][(year, month)] = revision_count
+        counts['total'] += revision_count
     
     return counts
 
@@ -118,30 +151,61 @@ def format_revision_counts(page_name: str, counts: dict) -> str:
     
     return "\n".join(output)
 
-def main(page: str, data_dir: Path, lang:str, count_only: bool = False):
+def main(page: str, data_dir: Path, lang:str, count_only: bool = False, stream: bool = True, paginate: bool = False, codec: str = "none", layout: str = "files", text_store: str = "inline", workers: int = 1, use_cache: bool = True):
     """
     Downloads all revisions of the given page title and organizes them by date.
     If count_only is True, just prints the count of stored revisions.
+    If stream is True, revisions are written as they arrive instead of buffering
+    the whole export in memory first.
+    If paginate is True, the history is fetched in resumable batches of 1000
+    revisions, which gets past the truncation of single export requests.
+    codec selects how the revision files are compressed on disk, and layout
+    whether each revision gets its own file or is appended to a segment per month.
+    text_store "blobs" stores each distinct text once, in <data_dir>/.blobs, which
+    shrinks reverted pages; "deltas" stores each text as a delta from the previous one.
+    With paginate and more than one worker, time ranges of the history are
+    downloaded concurrently.
+    If use_cache is True, single-request exports go through an HTTP cache in
+    <data_dir>/.http_cache, so re-running on the same page is served locally.
     """
     if count_only:
         counts = count_stored_revisions(page, data_dir)
         print(format_revision_counts(page, counts))
         return
 
-    print(f"Downloading complete history of {page}")
-    raw_revisions = download_page_w_revisions(page, lang=lang)
-    
-    # Count total revisions for progress bar
-    total_revisions = len(BeautifulSoup(raw_revisions, "lxml-xml").find_all("revision"))
-    print(f"Found {total_revisions} revisions. Organizing into directory structure...")
-    
-    for wiki_revision in tqdm(parse_mediawiki_revisions(raw_revisions), total=total_revisions):
-        revision_path = construct_path(
-            wiki_revision=wiki_revision, page_name=page, save_dir=data_dir
-        )
-        if not revision_path.exists():
-            revision_path.parent.mkdir(parents=True, exist_ok=True)
-            revision_path.write_text(wiki_revision, encoding="utf-8")
+    if paginate:
+        print(f"Downloading complete history of {page} in batches")
+        if workers > 1:
+            downloaded = download_history_parallel(page, save_dir=data_dir, lang=lang, workers=workers, codec=codec, layout=layout, text_store=text_store)
+        else:
+            downloaded = download_history(page, save_dir=data_dir, lang=lang, codec=codec, layout=layout, text_store=text_store)
+        print(f"Downloaded {downloaded} revisions.")
+        counts = count_stored_revisions(page, data_dir)
+        print("\nFinal revision counts:")
+        print(format_revision_counts(page, counts))
+        return
+
+    cache = HttpCache(data_dir / CACHE_DIR_NAME) if use_cache else None
+    if stream:
+        print(f"Streaming complete history of {page}")
+        records = stream_page_revisions(page, lang=lang, cache=cache)
+        total_revisions = None
+    else:
+        print(f"Downloading complete history of {page}")
+        raw_revisions = download_page_w_revisions(page, lang=lang, cache=cache)
+
+        # Count total revisions for progress bar without parsing the document
+        total_revisions = count_revisions_in_xml(raw_revisions)
+        print(f"Found {total_revisions} revisions. Organizing into directory structure...")
+        records = iter_revision_records([raw_revisions.encode("utf-8")])
+
+    # The only parse of the export happens here, while the records are written
+    processed = 0
+    written = 0
+    for record in tqdm(records, total=total_revisions, unit="rev"):
+        processed += 1
+        written += write_revision(record, page_name=page, save_dir=data_dir, codec=codec, layout=layout, lang=lang, text_store=text_store)
+    print(f"Processed {processed} revisions, {written} of them new.")
     
     # Show final counts
     counts = count_stored_revisions(page, data_dir)
@@ -186,9 +250,8 @@ def construct_path(page_name: str, save_dir: Path, wiki_revision: str) -> Path:
 
 
 def validate_page(page_name: str, page_xml: str) -> None:
-    try:
-        _ = _extract_attribute(page_xml, attribute="page")
-    except ValueError:
+    # Missing pages come back as an export without any <page> element
+    if "<page>" not in page_xml:
         raise ValueError(f"Page {page_name} does not exist")
 
 if __name__ == "__main__":
@@ -215,8 +278,57 @@ if __name__ == "__main__":
         default='en',
         help='Domain/country code to get pages in different languages.'
     )
+    parser.add_argument(
+        "--stream",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Parse and save revisions while downloading instead of buffering the whole export",
+    )
+    parser.add_argument(
+        "--paginate",
+        action="store_true",
+        help="Download the full history in resumable batches of 1000 revisions",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=CODECS,
+        default="none",
+        help="Compression for the stored revision files",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="files",
+        help="Store one file per revision, or one segment file per month",
+    )
+    parser.add_argument(
+        "--text-store",
+        choices=TEXT_STORES,
+        default="inline",
+        help="Keep texts in the revision XML, once per distinct text under "
+        "<data-dir>/.blobs, or as deltas with periodic keyframes per page",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="With --paginate, download this many time ranges of the history at once",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Serve repeated exports from the HTTP cache in <data-dir>/.http_cache",
+    )
     args = parser.parse_args()
     main(page=args.page, 
          data_dir=args.data_dir, 
          count_only=args.count_only, 
-         lang=args.lang)
+         lang=args.lang,
+         stream=args.stream,
+         paginate=args.paginate,
+         codec=args.codec,
+         layout=args.layout,
+         text_store=args.text_store,
+         workers=args.workers,
+         use_cache=args.cache)
@@ -0,0 +1,240 @@
+import argparse
+import os
+from pathlib import Path
+
+import pandas as pd
+from tqdm import tqdm
+
+from utils.dump_reader import open_dump_revisions
+from utils.export_stream import revision_record
+from utils.revision_store import CODECS, LAYOUTS, TEXT_STORES, write_revision
+from xml_to_dataframe import build_dataframe, print_summary, revision_fields
+
+DATA_DIR = Path("data")
+
+
+def page_directory_name(title: str) -> str:
+    return title.replace(" ", "_")
+
+
+def ingest_to_store(
+    dump: Path,
+    data_dir: Path,
+    titles: list[str] | None = None,
+    namespaces: list[int] | None = None,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    index: Path | None = None,
+    workers: int = 1,
+) -> dict[str, int]:
+    """
+    Streams a dump into the <page>/<year>/<month>/<revision_id>.xml layout.
+    Returns the number of revisions read per page.
+    """
+    counts = {}
+    with open_dump_revisions(dump, titles, namespaces, index, workers) as revisions:
+        for title, revision in tqdm(revisions, desc="Ingesting", unit="rev"):
+            page = page_directory_name(title)
+            write_revision(
+                revision_record(revision),
+                page,
+                data_dir,
+                codec=codec,
+                layout=layout,
+                text_store=text_store,
+            )
+            counts[page] = counts.get(page, 0) + 1
+    return counts
+
+
+def _save_dataframe(
+    rows: list[dict], page: str, output_dir: Path, include_text: bool
+) -> None:
+    df = build_dataframe([pd.DataFrame(rows)])
+    df.to_feather(output_dir / f"{page}.feather")
+    print_summary(df, page, include_text)
+
+
+def ingest_to_dataframes(
+    dump: Path,
+    output_dir: Path,
+    titles: list[str] | None = None,
+    namespaces: list[int] | None = None,
+    include_text: bool = False,
+    index: Path | None = None,
+    workers: int = 1,
+) -> dict[str, int]:
+    """
+    Streams a dump straight into one Feather file per page, with the same
+    columns xml_to_dataframe produces. Only the rows of the page currently
+    being read are held in memory.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    page = None
+    rows = []
+    with open_dump_revisions(dump, titles, namespaces, index, workers) as revisions:
+        for title, revision in tqdm(revisions, desc="Ingesting", unit="rev"):
+            if page_directory_name(title) != page:
+                if rows:
+                    _save_dataframe(rows, page, output_dir, include_text)
+                page = page_directory_name(title)
+                rows = []
+            data = revision_fields(revision, include_text)
+            data["year"] = data["timestamp"][:4]
+            data["month"] = data["timestamp"][5:7]
+            rows.append(data)
+            counts[page] = counts.get(page, 0) + 1
+    if rows:
+        _save_dataframe(rows, page, output_dir, include_text)
+    return counts
+
+
+def read_titles(path: Path) -> list[str]:
+    lines = path.read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def default_workers(dump: Path, index: Path | None) -> int:
+    """
+    All cores for dumps known to be multistream, one process otherwise.
+    Without an index the streams have to be found by scanning the whole
+    file first, which for a single-stream dump only means reading it twice.
+    """
+    if index is not None or "multistream" in dump.name:
+        return os.cpu_count() or 1
+    return 1
+
+
+def main(
+    dump: Path,
+    data_dir: Path | None = None,
+    output_dir: Path | None = None,
+    titles: list[str] | None = None,
+    namespaces: list[int] | None = None,
+    include_text: bool = False,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    index: Path | None = None,
+    workers: int = 1,
+) -> None:
+    """
+    Ingests the revisions of the selected pages from a pages-meta-history
+    dump, either into the revision directory layout or directly into
+    DataFrames. With the index of a multistream dump, only the compressed
+    streams holding the selected pages are read. Full passes over multistream
+    bz2 dumps decompress on `workers` processes.
+    """
+    if output_dir is not None:
+        counts = ingest_to_dataframes(
+            dump,
+            output_dir,
+            titles,
+            namespaces,
+            include_text=include_text,
+            index=index,
+            workers=workers,
+        )
+    else:
+        counts = ingest_to_store(
+            dump,
+            data_dir or DATA_DIR,
+            titles,
+            namespaces,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            index=index,
+            workers=workers,
+        )
+    for page, count in counts.items():
+        print(f"{page}: {count} revisions")
+    if titles:
+        missing = {page_directory_name(t) for t in titles} - counts.keys()
+        for page in sorted(missing):
+            print(f"{page}: not found in dump")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingest Wikipedia revisions from a pages-meta-history dump",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("dump", type=Path, help="Dump file (.xml, .xml.bz2 or .xml.gz)")
+    parser.add_argument(
+        "--titles", nargs="+", help="Only ingest these pages (default: all)"
+    )
+    parser.add_argument(
+        "--titles-file", type=Path, help="File with one page title per line"
+    )
+    parser.add_argument(
+        "--namespaces",
+        type=int,
+        nargs="+",
+        help="Only ingest pages in these namespaces, e.g. 0 for articles",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=DATA_DIR,
+        help="Directory to store the revision data",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        help="Write one DataFrame per page here instead of revision files",
+    )
+    parser.add_argument(
+        "--include-text",
+        action="store_true",
+        help="Include full text content in the DataFrames",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=CODECS,
+        default="none",
+        help="Compression for the stored revision files",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="files",
+        help="Store one file per revision, or one segment file per month",
+    )
+    parser.add_argument(
+        "--text-store",
+        choices=TEXT_STORES,
+        default="inline",
+        help="Keep texts in the revision XML, once per distinct text under "
+        "<data-dir>/.blobs, or as deltas with periodic keyframes per page",
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        help="multistream-index file of the dump, to seek straight to the selected pages",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes decompressing a multistream bz2 dump. If unset, all cores "
+        "with --index or a *multistream* file name, otherwise 1",
+    )
+    args = parser.parse_args()
+    titles = args.titles or []
+    if args.titles_file:
+        titles += read_titles(args.titles_file)
+    main(
+        args.dump,
+        data_dir=args.data_dir,
+        output_dir=args.output_dir,
+        titles=titles or None,
+        namespaces=args.namespaces,
+        include_text=args.include_text,
+        codec=args.codec,
+        layout=args.layout,
+        text_store=args.text_store,
+        index=args.index,
+        workers=args.workers or default_workers(args.dump, args.index),
+    )
@@ -3,6 +3,8 @@ import pandas as pd
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+from utils.revision_store import count_month_revisions, iter_month_revisions, month_dirs
+
 def parse_revision_xml(xml_content: str, include_text: bool = False) -> dict:
     """Parse a single revision XML string into a dictionary."""
     soup = BeautifulSoup(xml_content, "lxml-xml")
@@ -41,35 +43,37 @@ def parse_revision_xml(xml_content: str, include_text: bool = False) -> dict:
 
 def process_article_directory(article_dir: Path, batch_size: int = 1000, include_text: bool = False) -> pd.DataFrame:
     """Process all revisions for an article into a single DataFrame."""
-    # Collect all XML files recursively in each year/month directory
-    xml_files = list(article_dir.glob("*/**/*.xml"))  # Searches within each year/month/subdir structure
+    # Count the revisions in each year/month directory, stored as files or in a segment
+    months = month_dirs(article_dir)
+    total = sum(count_month_revisions(month_dir) for month_dir in months)
     
-    print(f"Found {len(xml_files)} XML files in {article_dir}")  # Debugging output
+    print(f"Found {total} revisions in {article_dir}")  # Debugging output
     
-    if not xml_files:
-        print(f"No XML files found in {article_dir}")
+    if not total:
+        print(f"No revisions found in {article_dir}")
         return None
     
     dataframes = []
-    for i in tqdm(range(0, len(xml_files), batch_size),
-                  desc=f"Processing {article_dir.name}",
-                  unit="batch"):
-        batch = xml_files[i:i + batch_size]
-        revision_data = []
-        
-        for file_path in batch:
-            try:
-                xml_content = file_path.read_text(encoding="utf-8")  # Ensure UTF-8 encoding
-                data = parse_revision_xml(xml_content, include_text)
-                # Add file path information
-                data['year'] = file_path.parent.parent.name  # Assuming parent is the month directory
-                data['month'] = file_path.parent.name         # Assuming parent of the XML file is the month
-                revision_data.append(data)
-            except Exception as e:
-                print(f"Error processing {file_path}: {str(e)}")
-        
-        if revision_data:
-            dataframes.append(pd.DataFrame(revision_data))
+    revision_data = []
+    with tqdm(total=total, desc=f"Processing {article_dir.name}", unit="rev") as progress:
+        for month_dir in months:
+            for revision_id, xml_bytes in iter_month_revisions(month_dir):
+                try:
+                    data = parse_revision_xml(xml_bytes.decode("utf-8"), include_text)
+                    # Add the year and month from the directory layout
+                    data['year'] = month_dir.parent.name
+                    data['month'] = month_dir.name
+                    revision_data.append(data)
+                except Exception as e:
+                    print(f"Error processing revision {revision_id} in {month_dir}: {str(e)}")
+                progress.update()
+                
+                if len(revision_data) >= batch_size:
+                    dataframes.append(pd.DataFrame(revision_data))
+                    revision_data = []
+    
+    if revision_data:
+        dataframes.append(pd.DataFrame(revision_data))
     
     if not dataframes:
         return None
@@ -92,7 +96,8 @@ def main(data_dir: str, output_dir: str, batch_size: int = 1000, include_text: b
     combined_dataframes = []
     
     for article_dir in data_dir.iterdir():
-        if not article_dir.is_dir():
+        # Skip non-article directories such as .http_cache
+        if not article_dir.is_dir() or article_dir.name.startswith("."):
             continue
         
         print(f"Starting processing for {article_dir.name}")
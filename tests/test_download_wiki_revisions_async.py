@@ -0,0 +1,90 @@
+"""
+Downloads from the Special:Export stub with download_wiki_revisions_async and
+checks the stored revisions against the stub's history.
+"""
+
+import asyncio
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from lxml import etree
+from tqdm import tqdm
+
+from benchmarks.export_stub_server import StubExportServer
+from download_wiki_revisions_async import download_all, download_history_async
+from utils.http_session import async_client
+from utils.rate_limit import AdaptiveRateLimiter
+from utils.revision_store import iter_month_revisions, month_dirs
+
+REVISIONS = 300
+
+
+def stored_revisions(page_dir: Path) -> dict[str, tuple[str, str]]:
+    """(timestamp, text) of every stored revision of a page by id."""
+    stored = {}
+    for month_dir in month_dirs(page_dir):
+        for revision_id, xml in iter_month_revisions(month_dir):
+            element = etree.fromstring(xml)
+            stored[revision_id] = (
+                element.findtext("{*}timestamp"),
+                element.findtext("{*}text") or "",
+            )
+    return stored
+
+
+def expected_revisions(server: StubExportServer, page: str) -> dict:
+    return {
+        str(revision["id"]): (revision["timestamp"], revision["text"])
+        for revision in server.wiki.history(page)
+    }
+
+
+def fast_limiter() -> AdaptiveRateLimiter:
+    return AdaptiveRateLimiter(host_rate=1000, global_rate=1000, max_rate=1000)
+
+
+@pytest.fixture(scope="module")
+def server() -> Generator[StubExportServer, None, None]:
+    with StubExportServer(revisions=REVISIONS) as server:
+        yield server
+
+
+@pytest.mark.parametrize(
+    ("layout", "text_store"),
+    [("files", "inline"), ("segments", "blobs"), ("segments", "deltas")],
+)
+def test_history_matches_stub(
+    server: StubExportServer, tmp_path: Path, layout: str, text_store: str
+) -> None:
+    # Batches of 7 end inside runs of revisions made in the same second
+    async def download() -> int:
+        async with async_client(4) as client:
+            return await download_history_async(
+                client,
+                "Page_A",
+                "en",
+                tmp_path,
+                asyncio.Semaphore(2),
+                tqdm(disable=True),
+                base_url=server.base_url,
+                batch_size=7,
+                layout=layout,
+                text_store=text_store,
+                limiter=fast_limiter(),
+            )
+
+    assert asyncio.run(download()) == REVISIONS
+    assert stored_revisions(tmp_path / "Page_A") == expected_revisions(server, "Page_A")
+
+
+def test_download_all(server: StubExportServer, tmp_path: Path) -> None:
+    pairs = [("Page_B", "en"), ("Page_C", "en"), ("Missing_page", "en")]
+    results = asyncio.run(
+        download_all(pairs, tmp_path, base_url=server.base_url, limiter=fast_limiter())
+    )
+    assert results["Page_B", "en"] == REVISIONS
+    assert results["Page_C", "en"] == REVISIONS
+    assert isinstance(results["Missing_page", "en"], ValueError)
+    for page in ("Page_B", "Page_C"):
+        assert stored_revisions(tmp_path / page) == expected_revisions(server, page)
@@ -0,0 +1,75 @@
+"""
+Checks that the revision index answers existence, count and first/last
+queries as the disk would, including after revisions are deleted or copied
+in behind its back.
+"""
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+from benchmarks.synthetic_export import export_document
+from utils import revision_store
+from utils.export_stream import RevisionRecord, iter_revision_records
+from utils.revision_store import (
+    count_page_revisions,
+    find_first_revision,
+    find_last_revision,
+    stored_month_counts,
+    write_revision,
+)
+
+
+@pytest.fixture(scope="module")
+def records() -> list[RevisionRecord]:
+    return list(iter_revision_records([export_document("Page", 200, seed=1)]))
+
+
+def new_process() -> None:
+    """Forgets which pages were synced, as a fresh run would."""
+    revision_store._synced.clear()
+
+
+@pytest.mark.parametrize("layout", ["files", "segments"])
+def test_queries_follow_the_disk(
+    records: list[RevisionRecord], tmp_path: Path, layout: str
+) -> None:
+    assert sum(write_revision(r, "Page", tmp_path, layout=layout) for r in records)
+    assert not any(write_revision(r, "Page", tmp_path, layout=layout) for r in records)
+    page_dir = tmp_path / "Page"
+    assert count_page_revisions(page_dir) == len(records)
+    assert find_first_revision(page_dir).revision_id == records[0].revision_id
+    assert find_last_revision(page_dir).timestamp == records[-1].timestamp
+
+    (year, month), deleted = next(iter(stored_month_counts(page_dir).items()))
+    shutil.rmtree(page_dir / year / month)
+    assert count_page_revisions(page_dir) == len(records) - deleted
+    new_process()
+    written = sum(write_revision(r, "Page", tmp_path, layout=layout) for r in records)
+    assert written == deleted
+
+    shutil.rmtree(page_dir)
+    assert find_last_revision(page_dir) is None
+    written = sum(write_revision(r, "Page", tmp_path, layout=layout) for r in records)
+    assert written == len(records)
+
+
+def test_page_stored_before_the_index(
+    records: list[RevisionRecord], tmp_path: Path
+) -> None:
+    other = tmp_path / "other"
+    for record in records:
+        write_revision(record, "Page", other)
+    shutil.copytree(other / "Page", tmp_path / "data" / "Page")
+    new_process()
+    page_dir = tmp_path / "data" / "Page"
+    assert count_page_revisions(page_dir) == len(records)
+    assert not any(write_revision(r, "Page", tmp_path / "data") for r in records)
+
+    last = find_last_revision(page_dir)
+    last.path.unlink()
+    copied = other / "Page" / last.path.relative_to(page_dir)
+    assert count_page_revisions(page_dir) == len(records) - 1
+    shutil.copy(copied, last.path)
+    assert find_last_revision(page_dir) == last
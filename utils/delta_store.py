@@ -0,0 +1,250 @@
+"""
+Revision texts of one page stored as deltas: a full keyframe every
+KEYFRAME_INTERVAL revisions and line-level differences from the previously
+stored revision in between, so reading any text applies a bounded number of
+deltas, and reading all texts of a keyframe group, in any order, applies one
+each.
+
+Texts are kept exactly as they appear inside the export's <text> element,
+that is still XML-escaped, so that revision XML can be put back together
+byte for byte. get_text and iter_texts return the plain wikitext.
+"""
+
+import difflib
+import json
+import threading
+import zlib
+from collections.abc import Generator
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from lxml import etree
+
+ARCHIVE_NAME = "texts.delta"
+INDEX_NAME = "texts.delta.idx"
+KEYFRAME_INTERVAL = 32
+MAX_OPEN_ARCHIVES = 64
+XML_PARSER = etree.XMLParser(huge_tree=True)
+
+
+class DeltaEntry(NamedTuple):
+    """One index line: a revision and where its keyframe or delta is."""
+
+    revision_id: str
+    keyframe: bool
+    offset: int
+    length: int
+
+
+def encode_delta(base: list[str], lines: list[str]) -> list:
+    """
+    The operations turning base into lines: [start, end] copies base lines,
+    a string is new text. The common head and tail are matched first, since
+    most edits touch one place in the page.
+    """
+    head = 0
+    while head < min(len(base), len(lines)) and base[head] == lines[head]:
+        head += 1
+    tail = 0
+    while (
+        tail < min(len(base), len(lines)) - head and base[-1 - tail] == lines[-1 - tail]
+    ):
+        tail += 1
+    ops = [[0, head]] if head else []
+    matcher = difflib.SequenceMatcher(
+        None, base[head : len(base) - tail], lines[head : len(lines) - tail]
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([head + i1, head + i2])
+        elif j2 > j1:
+            ops.append("".join(lines[head + j1 : head + j2]))
+    if tail:
+        ops.append([len(base) - tail, len(base)])
+    return ops
+
+
+def apply_delta(base: list[str], ops: list) -> str:
+    return "".join(
+        "".join(base[op[0] : op[1]]) if isinstance(op, list) else op for op in ops
+    )
+
+
+def apply_delta_lines(base: list[str], ops: list) -> list[str]:
+    """
+    Like apply_delta, but returns the lines. Copied lines are the same string
+    objects as in base, so the texts of a keyframe group share most memory.
+    """
+    lines = []
+    for op in ops:
+        if isinstance(op, list):
+            lines.extend(base[op[0] : op[1]])
+        else:
+            lines.extend(op.splitlines(keepends=True))
+    return lines
+
+
+def unescape_text(content: str) -> str:
+    """The wikitext of XML-escaped <text> content."""
+    element = etree.fromstring(f"<text>{content}</text>".encode(), XML_PARSER)
+    return element.text or ""
+
+
+class DeltaArchive:
+    """
+    The append-only delta file of a page, <page>/texts.delta, and its index
+    of tab separated lines. The texts reconstructed since the last keyframe
+    read are kept, so reading the revisions of a keyframe group costs one
+    delta each whatever the order, oldest or newest first.
+    """
+
+    def __init__(self, page_dir: Path, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.page_dir = page_dir
+        self.keyframe_interval = keyframe_interval
+        self.entries = []
+        self.positions = {}
+        self.lock = threading.Lock()
+        self._index_size = 0
+        # (keyframe position, lines of each text from it on) of the last group read
+        self._group = None
+
+    def refresh(self) -> None:
+        """Rereads the index if anyone else appended to it."""
+        index_path = self.page_dir / INDEX_NAME
+        size = index_path.stat().st_size if index_path.exists() else 0
+        if size == self._index_size:
+            return
+        data = index_path.read_bytes()
+        complete = data[: data.rfind(b"\n") + 1]
+        self.entries = []
+        for line in complete.decode("utf-8").splitlines():
+            revision_id, kind, offset, length = line.split("\t")
+            self.entries.append(
+                DeltaEntry(revision_id, kind == "key", int(offset), int(length))
+            )
+        self.positions = {e.revision_id: i for i, e in enumerate(self.entries)}
+        self._index_size = len(complete)
+        self._group = None
+
+    def _payload(self, archive: BinaryIO, entry: DeltaEntry) -> bytes:
+        archive.seek(entry.offset)
+        return zlib.decompress(archive.read(entry.length))
+
+    def _lines_at(self, position: int) -> list[str]:
+        start = position
+        while not self.entries[start].keyframe:
+            start -= 1
+        if self._group is not None and self._group[0] == start:
+            texts = self._group[1]
+            if position - start < len(texts):
+                return texts[position - start]
+        else:
+            texts = []
+            self._group = (start, texts)
+        with (self.page_dir / ARCHIVE_NAME).open("rb") as archive:
+            if not texts:
+                text = self._payload(archive, self.entries[start]).decode("utf-8")
+                texts.append(text.splitlines(keepends=True))
+            for entry in self.entries[start + len(texts) : position + 1]:
+                ops = json.loads(self._payload(archive, entry))
+                texts.append(apply_delta_lines(texts[-1], ops))
+        return texts[-1]
+
+    def content(self, revision_id: str) -> str | None:
+        """The escaped text of a revision, or None if it is not stored."""
+        with self.lock:
+            self.refresh()
+            position = self.positions.get(revision_id)
+            if position is None:
+                return None
+            return "".join(self._lines_at(position))
+
+    def append(self, revision_id: str, content: str) -> bool:
+        """
+        Stores a revision's escaped text as a delta from the previous one, or
+        as a keyframe at every keyframe_interval-th revision and whenever the
+        delta would not be smaller. Returns False if it was already stored.
+        """
+        with self.lock:
+            self.refresh()
+            if revision_id in self.positions:
+                return False
+            keyframe = zlib.compress(content.encode("utf-8"))
+            payload, kind = keyframe, "key"
+            position = len(self.entries)
+            lines = content.splitlines(keepends=True)
+            if position % self.keyframe_interval:
+                base = self._lines_at(position - 1)
+                ops = encode_delta(base, lines)
+                delta = zlib.compress(json.dumps(ops).encode("utf-8"))
+                if len(delta) < len(keyframe):
+                    payload, kind = delta, "delta"
+                    lines = apply_delta_lines(base, ops)
+            self.page_dir.mkdir(parents=True, exist_ok=True)
+            with (self.page_dir / ARCHIVE_NAME).open("ab") as archive:
+                offset = archive.tell()
+                archive.write(payload)
+            fields = [revision_id, kind, str(offset), str(len(payload))]
+            line = ("\t".join(fields) + "\n").encode("utf-8")
+            with (self.page_dir / INDEX_NAME).open("ab") as index:
+                # Drop the remainder of an interrupted write before appending
+                index.truncate(self._index_size)
+                index.write(line)
+            self._index_size += len(line)
+            self.entries.append(
+                DeltaEntry(revision_id, kind == "key", offset, len(payload))
+            )
+            self.positions[revision_id] = position
+            if kind == "key":
+                self._group = (position, [lines])
+            else:
+                # _lines_at above left the group ending at the previous text
+                self._group[1].append(lines)
+            return True
+
+    def iter_contents(self) -> Generator[tuple[str, str], None, None]:
+        """Yields (revision_id, escaped text) in stored order, one delta each."""
+        with self.lock:
+            self.refresh()
+            entries = list(self.entries)
+        lines = []
+        with (self.page_dir / ARCHIVE_NAME).open("rb") as archive:
+            for entry in entries:
+                payload = self._payload(archive, entry)
+                if entry.keyframe:
+                    text = payload.decode("utf-8")
+                else:
+                    text = apply_delta(lines, json.loads(payload))
+                lines = text.splitlines(keepends=True)
+                yield entry.revision_id, text
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def delta_archive(page_dir: Path) -> DeltaArchive:
+    """The process-wide archive object of a page."""
+    with _archives_lock:
+        if page_dir not in _archives:
+            if len(_archives) >= MAX_OPEN_ARCHIVES:
+                _archives.clear()
+            _archives[page_dir] = DeltaArchive(page_dir)
+        return _archives[page_dir]
+
+
+def get_text(page_dir: Path, revision_id: str) -> str | None:
+    """
+    The wikitext of one revision, reconstructed from the nearest keyframe
+    with at most KEYFRAME_INTERVAL - 1 deltas.
+    """
+    content = delta_archive(page_dir).content(revision_id)
+    return None if content is None else unescape_text(content)
+
+
+def iter_texts(page_dir: Path) -> Generator[tuple[str, str], None, None]:
+    """Streams (revision_id, wikitext) for every stored revision of a page."""
+    if not (page_dir / INDEX_NAME).exists():
+        return
+    for revision_id, content in delta_archive(page_dir).iter_contents():
+        yield revision_id, unescape_text(content)
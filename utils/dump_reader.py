@@ -0,0 +1,283 @@
+"""Streaming reads of pages-meta-history XML dumps."""
+
+import bz2
+import gzip
+import io
+import os
+import re
+from collections import deque
+from collections.abc import Generator, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+
+from lxml import etree
+
+ROOT_START = re.compile(rb"<mediawiki\b[^>]*>")
+DUMP_TAGS = ("{*}title", "{*}ns", "{*}revision", "{*}page")
+# Stream header ("BZh" + block size) directly followed by the first block's
+# magic number. Every stream of a multistream file starts byte-aligned.
+STREAM_START = re.compile(rb"BZh[1-9]1AY&SY")
+RANGE_SIZE = 1 << 20
+
+
+def normalise_title(title: str) -> str:
+    """Dumps use spaces in titles, URLs and our page directories underscores."""
+    return title.replace("_", " ").strip()
+
+
+def open_dump(path: Path) -> BinaryIO:
+    """Opens a .xml, .xml.bz2 or .xml.gz dump for streaming reads."""
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rb")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return path.open("rb")
+
+
+def iter_dump_revisions(
+    source: BinaryIO,
+    titles: Iterable[str] | None = None,
+    namespaces: Iterable[int] | None = None,
+) -> Generator[tuple[str, etree._Element], None, None]:
+    """
+    Yields (title, <revision> element) for every revision of the pages that
+    match the title and namespace filters, in dump order.
+
+    Elements are cleared as soon as the consumer moves on and finished pages
+    are dropped from the tree, so memory stays flat however large the dump.
+    When filtering by title, reading stops once every title has been seen.
+    """
+    remaining = {normalise_title(title) for title in titles} if titles else None
+    namespaces = set(namespaces) if namespaces is not None else None
+    title = None
+    keep = False
+    for _, element in etree.iterparse(
+        source, events=("end",), tag=DUMP_TAGS, huge_tree=True
+    ):
+        name = etree.QName(element).localname
+        if name == "title":
+            title = element.text
+        elif name == "ns":
+            keep = (remaining is None or normalise_title(title) in remaining) and (
+                namespaces is None or int(element.text) in namespaces
+            )
+        elif name == "revision":
+            if keep:
+                yield title, element
+            element.clear()
+        else:
+            element.clear()
+            if keep and remaining is not None:
+                remaining.discard(normalise_title(title))
+                if not remaining:
+                    return
+            keep = False
+        if name in ("revision", "page"):
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def read_multistream_index(index_path: Path, titles: Iterable[str]) -> dict[str, int]:
+    """
+    Looks titles up in a multistream index (lines of offset:page_id:title),
+    returning the byte offset of the bz2 stream that holds each page found.
+    """
+    wanted = {normalise_title(title) for title in titles}
+    offsets = {}
+    with open_dump(index_path) as index:
+        for line in io.TextIOWrapper(index, encoding="utf-8"):
+            offset, _, title = line.rstrip("\n").split(":", 2)
+            if title in wanted:
+                offsets[title] = int(offset)
+                if len(offsets) == len(wanted):
+                    break
+    return offsets
+
+
+def read_stream_block(dump: BinaryIO, offset: int, chunk_size: int = 1 << 16) -> bytes:
+    """Decompresses the single bz2 stream starting at offset in a multistream dump."""
+    dump.seek(offset)
+    decompressor = bz2.BZ2Decompressor()
+    parts = []
+    while not decompressor.eof:
+        chunk = dump.read(chunk_size)
+        if not chunk:
+            break
+        parts.append(decompressor.decompress(chunk))
+    return b"".join(parts)
+
+
+def wrap_stream_block(block: bytes, root: bytes = b"<mediawiki>") -> bytes:
+    """
+    Streams of a multistream dump hold bare <page> elements; the <mediawiki>
+    root only opens in the first stream (with the siteinfo header) and
+    closes in the last. Wraps a block in the given root start tag so it
+    parses as a document in the export namespace.
+    """
+    block = block.replace(b"</mediawiki>", b"")
+    if not ROOT_START.search(block):
+        block = root + block
+    return block + b"</mediawiki>"
+
+
+def iter_multistream_revisions(
+    dump_path: Path,
+    index_path: Path,
+    titles: Iterable[str],
+    namespaces: Iterable[int] | None = None,
+) -> Generator[tuple[str, etree._Element], None, None]:
+    """
+    Yields (title, <revision> element) for the requested pages of a
+    multistream dump, decompressing only the streams that hold them.
+    """
+    titles = list(titles)
+    offsets = read_multistream_index(index_path, titles)
+    with dump_path.open("rb") as dump:
+        header = ROOT_START.search(read_stream_block(dump, 0))
+        root = header.group() if header else b"<mediawiki>"
+        for offset in sorted(set(offsets.values())):
+            wanted = [title for title, at in offsets.items() if at == offset]
+            block = wrap_stream_block(read_stream_block(dump, offset), root)
+            yield from iter_dump_revisions(io.BytesIO(block), wanted, namespaces)
+
+
+def scan_stream_offsets(dump_path: Path, chunk_size: int = 1 << 24) -> list[int]:
+    """Finds where each bz2 stream of a multistream file starts."""
+    offsets = []
+    overlap = 9
+    position = 0
+    tail = b""
+    with dump_path.open("rb") as dump:
+        while chunk := dump.read(chunk_size):
+            data = tail + chunk
+            start = position - len(tail)
+            offsets.extend(start + m.start() for m in STREAM_START.finditer(data))
+            tail = data[-overlap:]
+            position += len(chunk)
+    return sorted(set(offsets))
+
+
+def stream_offsets(dump_path: Path, index_path: Path | None = None) -> list[int]:
+    """
+    Stream start offsets, taken from the multistream index when there is one.
+    The index omits the header stream, so offset 0 is always included.
+    """
+    if index_path is None:
+        return scan_stream_offsets(dump_path)
+    offsets = {0}
+    with open_dump(index_path) as index:
+        for line in io.TextIOWrapper(index, encoding="utf-8"):
+            offsets.add(int(line.split(":", 1)[0]))
+    return sorted(offsets)
+
+
+def stream_ranges(
+    offsets: list[int], size: int, range_size: int = RANGE_SIZE
+) -> list[tuple[int, int]]:
+    """
+    Groups consecutive streams into (start, end) byte ranges of at least
+    range_size compressed bytes, the unit of work handed to each process.
+    """
+    ranges = []
+    start = 0
+    for offset in [*offsets, size]:
+        if offset - start >= range_size or (offset == size and offset > start):
+            ranges.append((start, offset))
+            start = offset
+    return ranges
+
+
+def decompress_range(dump_path: Path, start: int, end: int) -> bytes:
+    """Decompresses the whole streams between two byte offsets of a dump."""
+    with dump_path.open("rb") as dump:
+        dump.seek(start)
+        return bz2.decompress(dump.read(end - start))
+
+
+def iter_parallel_bz2(
+    dump_path: Path,
+    index_path: Path | None = None,
+    workers: int | None = None,
+    range_size: int = RANGE_SIZE,
+) -> Generator[bytes, None, None]:
+    """
+    Yields the decompressed contents of a bz2 dump in order, decompressing
+    its streams in a process pool. At most two ranges per worker are in
+    flight, so memory stays bounded however far the parser falls behind.
+    Single-stream files are decompressed sequentially.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = stream_ranges(
+        stream_offsets(dump_path, index_path), dump_path.stat().st_size, range_size
+    )
+    if workers == 1 or len(ranges) <= 1:
+        with bz2.open(dump_path, "rb") as dump:
+            while chunk := dump.read(range_size):
+                yield chunk
+        return
+
+    executor = ProcessPoolExecutor(workers)
+    pending = deque()
+    try:
+        for start, end in ranges:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(decompress_range, dump_path, start, end))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+class ChunkReader(io.RawIOBase):
+    """A read-only file over an iterator of byte chunks, for iterparse."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self) -> None:
+        if hasattr(self._chunks, "close"):
+            self._chunks.close()
+        super().close()
+
+
+@contextmanager
+def open_dump_revisions(
+    dump_path: Path,
+    titles: Iterable[str] | None = None,
+    namespaces: Iterable[int] | None = None,
+    index_path: Path | None = None,
+    workers: int = 1,
+) -> Iterator[Iterator[tuple[str, etree._Element]]]:
+    """
+    The matching revisions of a dump. With titles and a multistream index,
+    only the streams holding those pages are read. Otherwise the whole file
+    is streamed, its bz2 streams decompressed by `workers` processes
+    (located through the index when given, by scanning the file if not).
+    """
+    if index_path is not None and titles:
+        yield iter_multistream_revisions(dump_path, index_path, titles, namespaces)
+    elif workers != 1 and dump_path.suffix == ".bz2":
+        chunks = iter_parallel_bz2(dump_path, index_path, workers)
+        with io.BufferedReader(ChunkReader(chunks), RANGE_SIZE) as source:
+            yield iter_dump_revisions(source, titles, namespaces)
+    else:
+        with open_dump(dump_path) as source:
+            yield iter_dump_revisions(source, titles, namespaces)
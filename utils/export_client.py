@@ -0,0 +1,490 @@
+"""Paginated, resumable downloads from Special:Export."""
+
+import itertools
+import json
+import math
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+from tqdm import tqdm
+
+from utils.export_stream import (
+    RevisionRecord,
+    format_timestamp,
+    iter_page_revision_records,
+    iter_revision_records,
+)
+from utils.http_cache import HttpCache
+from utils.http_session import get_session
+from utils.revision_store import write_revision
+
+WIKI_URL = "https://{lang}.wikipedia.org"
+EXPORT_LIMIT = 1000  # Special:Export never returns more revisions per request
+CHECKPOINT_NAME = ".export_checkpoint.json"
+MIN_RANGE_BATCH = 50  # smallest follow-up request of a time range
+
+
+def export_params(
+    page_title: str, limit: int, offset: str | None = None, direction: str = "asc"
+) -> dict:
+    """Form data for one page of a Special:Export history request."""
+    params = {
+        "title": "Special:Export",
+        "pages": page_title,
+        "limit": min(limit, EXPORT_LIMIT),
+        "dir": direction,
+        "action": "submit",
+    }
+    if offset is not None:
+        params["offset"] = offset
+    return params
+
+
+def title_key(title: str) -> str:
+    """
+    Compares titles the way MediaWiki does: underscores are spaces and the
+    first letter is case-insensitive.
+    """
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+
+def export_url(lang: str = "en", base_url: str = WIKI_URL) -> str:
+    return base_url.format(lang=lang) + "/w/index.php"
+
+
+class Continuation:
+    """
+    Where a paginated history continues. Export offsets are exclusive and
+    have one-second resolution, so continuing from the timestamp of the last
+    revision received would skip any other revision made in the same second.
+    The next request starts one second earlier instead, and the revisions of
+    that second which were already received are skipped by id.
+    """
+
+    def __init__(
+        self, direction: str = "asc", offset: str | None = None, seen: Iterable = ()
+    ):
+        self.direction = direction
+        self.offset = offset
+        self.seen = set(seen)
+        self._timestamp = None
+        self._received = set()
+
+    def is_new(self, record: RevisionRecord) -> bool:
+        """Notes a received revision; False if an earlier request brought it."""
+        if record.timestamp != self._timestamp:
+            self._timestamp = record.timestamp
+            self._received = set()
+        self._received.add(record.revision_id)
+        return record.revision_id not in self.seen
+
+    def advance(self) -> None:
+        """Continues after the last revision noted."""
+        step = timedelta(seconds=1 if self.direction == "desc" else -1)
+        self.offset = format_timestamp(self._timestamp + step)
+        self.seen = self._received
+        self._timestamp = None
+        self._received = set()
+
+
+def request_export(
+    params: dict, lang: str = "en", base_url: str = WIKI_URL
+) -> requests.Response:
+    """Sends an export request and returns the response unread, for streaming."""
+    response = get_session().post(export_url(lang, base_url), data=params, stream=True)
+    response.raise_for_status()
+    return response
+
+
+def export_chunks(
+    params: dict,
+    lang: str = "en",
+    base_url: str = WIKI_URL,
+    cache: HttpCache | None = None,
+) -> Iterable[bytes]:
+    """The body of an export request in chunks, through the cache if given."""
+    if cache is not None:
+        return cache.iter_content("POST", export_url(lang, base_url), data=params)
+    return request_export(params, lang, base_url).iter_content(chunk_size=8192)
+
+
+def load_checkpoint(page_dir: Path) -> dict | None:
+    """Returns the continuation state of an interrupted download, if any."""
+    path = page_dir / CHECKPOINT_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_checkpoint(page_dir: Path, checkpoint: dict) -> None:
+    """Atomically records how far a download got."""
+    page_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = page_dir / (CHECKPOINT_NAME + ".tmp")
+    tmp_path.write_text(json.dumps(checkpoint), encoding="utf-8")
+    tmp_path.replace(page_dir / CHECKPOINT_NAME)
+
+
+def clear_checkpoint(page_dir: Path) -> None:
+    (page_dir / CHECKPOINT_NAME).unlink(missing_ok=True)
+
+
+def resume_state(
+    page_dir: Path, direction: str, max_revisions: int | None
+) -> tuple[Continuation, int] | None:
+    """
+    The continuation and revision count to resume from, if an interrupted
+    download of the same kind left a checkpoint behind.
+    """
+    checkpoint = load_checkpoint(page_dir)
+    if (
+        checkpoint
+        and checkpoint["direction"] == direction
+        and checkpoint["max_revisions"] == max_revisions
+    ):
+        continuation = Continuation(
+            direction, checkpoint["offset"], checkpoint.get("seen", ())
+        )
+        return continuation, checkpoint["revisions"]
+    return None
+
+
+def checkpoint_batch(
+    page_dir: Path,
+    continuation: Continuation,
+    downloaded: int,
+    max_revisions: int | None,
+) -> None:
+    """Records the continuation after a batch has been written."""
+    save_checkpoint(
+        page_dir,
+        {
+            "offset": continuation.offset,
+            "seen": sorted(continuation.seen),
+            "revisions": downloaded,
+            "direction": continuation.direction,
+            "max_revisions": max_revisions,
+        },
+    )
+
+
+def download_history(
+    page_title: str,
+    save_dir: Path,
+    lang: str = "en",
+    max_revisions: int | None = None,
+    direction: str = "asc",
+    offset: str | None = None,
+    batch_size: int = EXPORT_LIMIT,
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    seen: Iterable[str] = (),
+    cache: HttpCache | None = None,
+) -> int:
+    """
+    Downloads a page history across as many export requests as needed.
+
+    Each request continues from the second of the last revision of the
+    previous one (see Continuation); seen holds revision ids at the given
+    offset that are not to be counted again. Revisions are written as they
+    stream in, and after every request the continuation is checkpointed in
+    <page>/.export_checkpoint.json, so an interrupted run picks up from there
+    instead of starting again at the first revision. The checkpoint is removed
+    once the history is complete. With a cache, export responses are served
+    from it when fresh.
+
+    Returns the number of revisions downloaded, including any from the run
+    being resumed.
+    """
+    page_dir = save_dir / page_title
+    downloaded = 0
+    continuation = Continuation(direction, offset, seen)
+    resumed = resume_state(page_dir, direction, max_revisions)
+    if resumed:
+        continuation, downloaded = resumed
+        print(
+            f"Resuming {page_title} after {continuation.offset}"
+            f" ({downloaded} revisions done)"
+        )
+
+    progress = tqdm(
+        total=max_revisions, initial=downloaded, desc=page_title, unit="rev"
+    )
+    while max_revisions is None or downloaded < max_revisions:
+        # The revisions received again do not count towards the limit
+        limit = batch_size + len(continuation.seen)
+        if max_revisions is not None:
+            limit = min(limit, max_revisions - downloaded + len(continuation.seen))
+        chunks = export_chunks(
+            export_params(
+                page_title, limit, offset=continuation.offset, direction=direction
+            ),
+            lang=lang,
+            base_url=base_url,
+            cache=cache,
+        )
+        received = 0
+        new = 0
+        for record in iter_revision_records(chunks):
+            received += 1
+            if not continuation.is_new(record):
+                continue
+            write_revision(
+                record,
+                page_name=page_title,
+                save_dir=save_dir,
+                codec=codec,
+                layout=layout,
+                text_store=text_store,
+                lang=lang,
+            )
+            new += 1
+            progress.update()
+        if received == 0 and downloaded == 0 and continuation.offset is None:
+            progress.close()
+            raise ValueError(f"Page {page_title} does not exist")
+        # Nothing new means a full batch within one second, past which
+        # offsets cannot page
+        if new == 0:
+            break
+
+        downloaded += new
+        continuation.advance()
+        checkpoint_batch(page_dir, continuation, downloaded, max_revisions)
+        if received < min(limit, EXPORT_LIMIT):
+            break
+
+    progress.close()
+    clear_checkpoint(page_dir)
+    return downloaded
+
+
+def download_batch(
+    page_titles: list[str],
+    save_dir: Path,
+    lang: str = "en",
+    max_revisions: int | None = None,
+    direction: str = "asc",
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    cache: HttpCache | None = None,
+) -> dict[str, int]:
+    """
+    Downloads several pages with a single export request, writing each
+    page's revisions under its own directory.
+
+    Special:Export applies the limit to every page separately, so one request
+    brings up to min(max_revisions, 1000) revisions of each page. Pages that
+    need more than that are continued one by one with download_history.
+
+    Returns the number of revisions downloaded per page. Pages that do not
+    exist are missing from the result.
+    """
+    limit = EXPORT_LIMIT if max_revisions is None else max_revisions
+    pages = {title_key(title): title for title in page_titles}
+    chunks = export_chunks(
+        export_params("\n".join(page_titles), limit, direction=direction),
+        lang=lang,
+        base_url=base_url,
+        cache=cache,
+    )
+    counts = {}
+    continuations = {}
+    records = iter_page_revision_records(chunks)
+    for title, record in tqdm(records, desc=f"{len(page_titles)} pages", unit="rev"):
+        page = pages.get(title_key(title), title.replace(" ", "_"))
+        continuations.setdefault(page, Continuation(direction)).is_new(record)
+        write_revision(
+            record,
+            page_name=page,
+            save_dir=save_dir,
+            codec=codec,
+            layout=layout,
+            text_store=text_store,
+            lang=lang,
+        )
+        counts[page] = counts.get(page, 0) + 1
+
+    for page, count in counts.items():
+        truncated = count >= min(limit, EXPORT_LIMIT)
+        if truncated and (max_revisions is None or count < max_revisions):
+            continuation = continuations[page]
+            continuation.advance()
+            counts[page] += download_history(
+                page,
+                save_dir,
+                lang=lang,
+                max_revisions=None if max_revisions is None else max_revisions - count,
+                direction=direction,
+                offset=continuation.offset,
+                seen=continuation.seen,
+                cache=cache,
+                base_url=base_url,
+                codec=codec,
+                layout=layout,
+                text_store=text_store,
+            )
+    return counts
+
+
+def timestamp_bounds(
+    page_title: str, lang: str = "en", base_url: str = WIKI_URL
+) -> tuple[datetime, datetime]:
+    """Timestamps of the first and the newest revision of a page."""
+    bounds = []
+    for direction in ("asc", "desc"):
+        response = request_export(
+            export_params(page_title, 1, direction=direction), lang, base_url
+        )
+        records = list(iter_revision_records(response.iter_content(chunk_size=8192)))
+        if not records:
+            raise ValueError(f"Page {page_title} does not exist")
+        bounds.append(records[0].timestamp)
+    return bounds[0], bounds[1]
+
+
+def time_ranges(
+    first: datetime, last: datetime, partitions: int
+) -> list[tuple[datetime, datetime]]:
+    """
+    Splits a history into consecutive (start, end] ranges of equal length,
+    on whole seconds like export offsets. Each revision is in exactly one.
+    """
+    start = first - timedelta(seconds=1)
+    step = (last - start) / partitions
+    edges = {(start + step * i).replace(microsecond=0) for i in range(partitions)}
+    edges = sorted(edges | {last})
+    return list(itertools.pairwise(edges))
+
+
+def range_limit(
+    first: datetime, last: datetime, received: int, end: datetime, batch_size: int
+) -> int:
+    """
+    The limit of a range's next request: the revisions expected up to end at
+    the rate the last batch (first to last timestamp) came in, with a
+    margin, so the final request of a range fetches little past its end.
+    """
+    span = max((last - first).total_seconds(), 1.0)
+    expected = (end - last).total_seconds() * received / span
+    return max(MIN_RANGE_BATCH, min(batch_size, math.ceil(expected * 1.25)))
+
+
+def download_range(
+    page_title: str,
+    save_dir: Path,
+    start: datetime,
+    end: datetime,
+    lang: str = "en",
+    batch_size: int = EXPORT_LIMIT,
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+    progress: tqdm | None = None,
+) -> int:
+    """
+    Downloads the revisions with start < timestamp <= end, oldest first.
+    After the first batch, requests are sized by range_limit. Returns how
+    many were received.
+    """
+    continuation = Continuation(offset=format_timestamp(start))
+    downloaded = 0
+    size = batch_size
+    while True:
+        limit = min(size + len(continuation.seen), EXPORT_LIMIT)
+        chunks = request_export(
+            export_params(page_title, limit, offset=continuation.offset),
+            lang,
+            base_url,
+        ).iter_content(chunk_size=8192)
+        received = 0
+        new = 0
+        first_record = last_record = None
+        past_end = False
+        for record in iter_revision_records(chunks):
+            if record.timestamp > end:
+                past_end = True
+                break
+            received += 1
+            first_record = first_record or record
+            last_record = record
+            if not continuation.is_new(record):
+                continue
+            write_revision(
+                record,
+                page_name=page_title,
+                save_dir=save_dir,
+                codec=codec,
+                layout=layout,
+                text_store=text_store,
+                lang=lang,
+            )
+            downloaded += 1
+            new += 1
+            if progress is not None:
+                progress.update()
+        # Read the rest of the body, so the connection goes back to the pool
+        for _ in chunks:
+            pass
+        if new == 0 or past_end or received < limit:
+            return downloaded
+        continuation.advance()
+        size = range_limit(
+            first_record.timestamp, last_record.timestamp, received, end, batch_size
+        )
+
+
+def download_history_parallel(
+    page_title: str,
+    save_dir: Path,
+    lang: str = "en",
+    workers: int = 4,
+    partitions: int | None = None,
+    batch_size: int = EXPORT_LIMIT,
+    base_url: str = WIKI_URL,
+    codec: str = "none",
+    layout: str = "files",
+    text_store: str = "inline",
+) -> int:
+    """
+    Downloads a full page history over several continuation chains at once.
+
+    The span between the first and the newest revision is cut into time
+    ranges, one per worker by default, and the ranges are fetched by a pool
+    of threads sharing the pooled session.
+    Ranges are half-open on timestamps, so together they hold every revision
+    exactly once. Unlike download_history there is no checkpoint; re-running
+    skips the revisions already stored.
+
+    Returns the number of revisions downloaded.
+    """
+    first, last = timestamp_bounds(page_title, lang, base_url)
+    ranges = time_ranges(first, last, partitions or workers)
+    with (
+        tqdm(desc=page_title, unit="rev") as progress,
+        ThreadPoolExecutor(workers) as pool,
+    ):
+        counts = pool.map(
+            lambda bounds: download_range(
+                page_title,
+                save_dir,
+                *bounds,
+                lang=lang,
+                batch_size=batch_size,
+                base_url=base_url,
+                codec=codec,
+                layout=layout,
+                text_store=text_store,
+                progress=progress,
+            ),
+            ranges,
+        )
+        return sum(counts)
@@ -0,0 +1,153 @@
+"""Incremental parsing of MediaWiki Special:Export XML."""
+
+from collections.abc import Generator, Iterable
+from datetime import datetime
+from typing import NamedTuple
+
+from lxml import etree
+
+REVISION_TAG = "{*}revision"
+ID_TAG = "{*}id"
+TIMESTAMP_TAG = "{*}timestamp"
+TITLE_TAG = "{*}title"
+PARENT_ID_TAG = "{*}parentid"
+CONTRIBUTOR_TAG = "{*}contributor"
+TEXT_TAG = "{*}text"
+SHA1_TAG = "{*}sha1"
+
+
+class RevisionRecord(NamedTuple):
+    """A revision split out of an export, ready to be written to disk."""
+
+    revision_id: str
+    timestamp: datetime
+    xml: bytes
+    parent_id: str | None = None
+    user: str | None = None
+    size: int | None = None
+    sha1: str | None = None
+
+
+def revision_parser() -> etree.XMLPullParser:
+    """An incremental parser that reports every closed <revision>."""
+    return etree.XMLPullParser(events=("end",), tag=REVISION_TAG, huge_tree=True)
+
+
+def iter_revision_elements(
+    chunks: Iterable[bytes],
+) -> Generator[etree._Element, None, None]:
+    """
+    Feeds raw export bytes into an incremental parser and yields every
+    <revision> element as soon as it closes.
+
+    Each element is cleared once the consumer moves on, and already processed
+    siblings are detached from the tree, so memory use does not grow with the
+    length of the page history. Consumers must copy whatever they need out of
+    an element before asking for the next one.
+    """
+    parser = revision_parser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from read_revision_elements(parser)
+    parser.close()
+    yield from read_revision_elements(parser)
+
+
+def read_revision_elements(
+    parser: etree.XMLPullParser,
+) -> Generator[etree._Element, None, None]:
+    """Yields the revisions completed by the data fed to the parser so far."""
+    for _, element in parser.read_events():
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def parse_timestamp(timestring: str) -> datetime:
+    """Parses an export timestamp such as 2024-01-31T12:00:00Z."""
+    return datetime.fromisoformat(timestring.rstrip("Z"))
+
+
+def format_timestamp(timestamp: datetime) -> str:
+    """Formats a timestamp the way exports (and their offset parameter) use it."""
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _text_size(element: etree._Element) -> int | None:
+    """The size of the revision text in bytes, as the export states it."""
+    text = element.find(TEXT_TAG)
+    if text is None:
+        return None
+    if text.get("bytes") is not None:
+        return int(text.get("bytes"))
+    return len((text.text or "").encode("utf-8"))
+
+
+def revision_record(element: etree._Element) -> RevisionRecord:
+    """
+    Pulls id, timestamp, the metadata the revision index keeps and the
+    serialised bytes out of a parsed <revision>.
+    """
+    revision_id = element.findtext(ID_TAG)
+    timestring = element.findtext(TIMESTAMP_TAG)
+    if revision_id is None or timestring is None:
+        raise ValueError("Revision is missing its id or timestamp")
+    contributor = element.find(CONTRIBUTOR_TAG)
+    user = None
+    if contributor is not None:
+        user = contributor.findtext("{*}username") or contributor.findtext("{*}ip")
+    return RevisionRecord(
+        revision_id=revision_id,
+        timestamp=parse_timestamp(timestring),
+        xml=etree.tostring(
+            element, encoding="utf-8", xml_declaration=False, with_tail=False
+        ),
+        parent_id=element.findtext(PARENT_ID_TAG),
+        user=user,
+        size=_text_size(element),
+        sha1=element.findtext(SHA1_TAG),
+    )
+
+
+def iter_revision_records(
+    chunks: Iterable[bytes],
+) -> Generator[RevisionRecord, None, None]:
+    """Splits an export stream into revision records in a single parse."""
+    for element in iter_revision_elements(chunks):
+        yield revision_record(element)
+
+
+def read_revision_records(
+    parser: etree.XMLPullParser,
+) -> Generator[RevisionRecord, None, None]:
+    """Records for the revisions completed by the data fed to the parser so far."""
+    for element in read_revision_elements(parser):
+        yield revision_record(element)
+
+
+def iter_page_revision_records(
+    chunks: Iterable[bytes],
+) -> Generator[tuple[str, RevisionRecord], None, None]:
+    """
+    Splits an export of several pages into (page title, revision record)
+    pairs, in a single parse like iter_revision_records.
+    """
+    parser = etree.XMLPullParser(
+        events=("end",), tag=(TITLE_TAG, REVISION_TAG), huge_tree=True
+    )
+    title = None
+
+    def completed() -> Generator[tuple[str, RevisionRecord], None, None]:
+        nonlocal title
+        for element in read_revision_elements(parser):
+            if etree.QName(element).localname == "title":
+                title = element.text
+            else:
+                yield title, revision_record(element)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from completed()
+    parser.close()
+    yield from completed()
@@ -0,0 +1,157 @@
+"""An on-disk cache for HTTP responses, revalidated with ETag/Last-Modified."""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections.abc import Generator
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.http_session import get_session
+
+CACHE_DIR_NAME = ".http_cache"
+MAX_BYTES = 1 << 30
+MAX_AGE = 24 * 3600  # for responses that come without validators
+
+
+class CacheEntry(NamedTuple):
+    body_path: Path
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+
+
+class HttpCache:
+    """
+    Response bodies stored as <key>.body, with their validators in
+    <key>.json, where the key is the sha256 of method, URL and parameters.
+
+    Entries with an ETag or Last-Modified validator are revalidated on every
+    use with If-None-Match / If-Modified-Since, and served from disk on a
+    304. Entries without validators are served without asking the server
+    while younger than max_age, and downloaded again after that. Once the
+    bodies outgrow max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self, directory: Path, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def key(
+        method: str, url: str, params: dict | None = None, data: dict | None = None
+    ) -> str:
+        request = [method.upper(), url, params or {}, data or {}]
+        encoded = json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def lookup(self, key: str) -> CacheEntry | None:
+        body_path = self.directory / f"{key}.body"
+        meta_path = self.directory / f"{key}.json"
+        if not body_path.exists() or not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return CacheEntry(
+            body_path, meta["etag"], meta["last_modified"], meta["stored_at"]
+        )
+
+    def iter_content(
+        self,
+        method: str,
+        url: str,
+        params: dict | None = None,
+        data: dict | None = None,
+        chunk_size: int = 1 << 16,
+    ) -> Generator[bytes, None, None]:
+        """
+        The response body in chunks: from disk when cached and revalidated
+        (or, without validators, fresh), otherwise streamed from the server while it is written
+        to the cache. A body is only stored once it has been read completely.
+        """
+        key = self.key(method, url, params, data)
+        entry = self.lookup(key)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+            if not headers and time.time() - entry.stored_at < self.max_age:
+                yield from self._read(entry, chunk_size)
+                return
+
+        response = get_session().request(
+            method, url, params=params, data=data, headers=headers, stream=True
+        )
+        try:
+            if response.status_code == 304 and entry is not None:
+                self._write_meta(key, url, entry.etag, entry.last_modified)
+                yield from self._read(entry, chunk_size)
+                return
+            response.raise_for_status()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=self.directory, suffix=".tmp", delete=False
+            ) as tmp:
+                try:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        tmp.write(chunk)
+                        yield chunk
+                except BaseException:
+                    tmp.close()
+                    Path(tmp.name).unlink()
+                    raise
+            Path(tmp.name).replace(self.directory / f"{key}.body")
+            self._write_meta(
+                key,
+                url,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        finally:
+            response.close()
+        self.evict()
+
+    def content(
+        self,
+        method: str,
+        url: str,
+        params: dict | None = None,
+        data: dict | None = None,
+    ) -> bytes:
+        return b"".join(self.iter_content(method, url, params, data))
+
+    def evict(self) -> None:
+        """Drops least recently used entries until the cache fits max_bytes."""
+        bodies = [(path, path.stat()) for path in self.directory.glob("*.body")]
+        total = sum(stat.st_size for _, stat in bodies)
+        for path, stat in sorted(bodies, key=lambda body: body[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= stat.st_size
+
+    def _read(self, entry: CacheEntry, chunk_size: int) -> Generator[bytes, None, None]:
+        os.utime(entry.body_path)  # the mtime orders entries for eviction
+        with entry.body_path.open("rb") as body:
+            while chunk := body.read(chunk_size):
+                yield chunk
+
+    def _write_meta(
+        self, key: str, url: str, etag: str | None, last_modified: str | None
+    ) -> None:
+        meta = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.time(),
+        }
+        tmp_path = self.directory / f"{key}.json.tmp"
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        tmp_path.replace(self.directory / f"{key}.json")
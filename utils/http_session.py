@@ -0,0 +1,175 @@
+"""
+Pooled HTTP sessions with keep-alive, retries, exponential backoff and
+adaptive rate limiting.
+"""
+
+import asyncio
+import functools
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, NamedTuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+from utils.rate_limit import AdaptiveRateLimiter, get_rate_limiter
+
+USER_AGENT = "oii-fsds-wikipedia/0.1 (https://github.com/eladvromen/oii-fsds-wikipedia)"
+# gzip and deflate, plus br and zstd when brotli / zstandard are installed.
+# Bodies are decoded incrementally as they stream, never buffered whole.
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_TIMEOUT = 60
+POOL_SIZE = 16
+
+
+class RetryPolicy(NamedTuple):
+    """How often and how patiently to retry transient failures."""
+
+    max_retries: int = 5
+    backoff_factor: float = 1.0
+    max_backoff: float = 60.0
+    jitter: float = 0.5
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Seconds to wait before retry number attempt + 1. A server-supplied
+        Retry-After always wins; otherwise the backoff doubles per attempt,
+        randomised by up to +/- jitter so that parallel workers spread out.
+        """
+        if retry_after is not None:
+            return retry_after
+        backoff = min(self.max_backoff, self.backoff_factor * 2**attempt)
+        return backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def retry_after_seconds(value: str | None) -> float | None:
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryingSession(requests.Session):
+    """
+    A requests session that keeps connections alive in a shared pool and
+    retries connection errors and retryable status codes with backoff.
+    With a rate limiter, every attempt waits for its host's turn and
+    reports back how the server responded.
+    """
+
+    def __init__(
+        self,
+        retry: RetryPolicy = RetryPolicy(),
+        pool_size: int = POOL_SIZE,
+        limiter: AdaptiveRateLimiter | None = None,
+    ):
+        super().__init__()
+        self.retry = retry
+        self.limiter = limiter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers["User-Agent"] = USER_AGENT
+        self.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+    def request(
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.wait(host)
+            started = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if self.limiter is not None:
+                    self.limiter.record(host, None, time.monotonic() - started)
+                if attempt >= self.retry.max_retries:
+                    raise
+                time.sleep(self.retry.delay(attempt))
+            else:
+                if self.limiter is not None:
+                    latency = time.monotonic() - started
+                    self.limiter.record(host, response.status_code, latency)
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= self.retry.max_retries
+                ):
+                    return response
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+
+@functools.cache
+def get_session() -> RetryingSession:
+    """The process-wide session every synchronous downloader shares."""
+    return RetryingSession(limiter=get_rate_limiter())
+
+
+def async_client(max_connections: int = POOL_SIZE) -> httpx.AsyncClient:
+    """An httpx client with a keep-alive pool sized for max_connections."""
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+    return httpx.AsyncClient(
+        limits=limits, timeout=DEFAULT_TIMEOUT, headers={"User-Agent": USER_AGENT}
+    )
+
+
+async def send_with_retries(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    retry: RetryPolicy = RetryPolicy(),
+    limiter: AdaptiveRateLimiter | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Async counterpart of RetryingSession.request. The response is returned
+    unread so the body can be streamed; the caller must close it.
+    """
+    host = urlsplit(url).netloc
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.wait_async(host)
+        request = client.build_request(method, url, **kwargs)
+        started = time.monotonic()
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError:
+            if limiter is not None:
+                limiter.record(host, None, time.monotonic() - started)
+            if attempt >= retry.max_retries:
+                raise
+            await asyncio.sleep(retry.delay(attempt))
+        else:
+            if limiter is not None:
+                latency = time.monotonic() - started
+                limiter.record(host, response.status_code, latency)
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt >= retry.max_retries
+            ):
+                return response
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            await response.aclose()
+            await asyncio.sleep(retry.delay(attempt, retry_after))
+        attempt += 1
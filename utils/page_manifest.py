@@ -0,0 +1,70 @@
+"""
+The manifest of a page: its <year>/<month> directories and the state each
+one is in, that is the mtime of the directory (a revision file added or
+removed) and the size of its segment index (a revision appended). The
+revision index keeps the state every month was last indexed at, so a month
+is listed again only when its state changed, and syncing a page that is
+already indexed stats each month instead of listing every file.
+"""
+
+import os
+import time
+from pathlib import Path
+
+from utils.segment_store import INDEX_NAME as SEGMENT_INDEX_NAME
+from utils.segment_store import count_segment
+
+# Directories changed this recently may still get files within the same
+# mtime tick, so they are listed again next time rather than trusted
+MTIME_SLACK_NS = 2_000_000_000
+UNSETTLED = (-1, -1)  # the state recorded for such a month
+
+
+def is_revision_file(name: str) -> bool:
+    """Whether a file name is a revision in any codec, like REVISION_GLOB."""
+    return ".xml" in name and not name.startswith(".")
+
+
+def date_dirs(parent: Path) -> list[Path]:
+    """Year or month directories under parent, oldest first."""
+    with os.scandir(parent) as entries:
+        return sorted(
+            Path(entry.path)
+            for entry in entries
+            if entry.name.isdigit() and entry.is_dir()
+        )
+
+
+def count_month(month_dir: Path) -> int:
+    """
+    How many revisions a month directory holds, as files or in its segment,
+    from the names in one directory listing.
+    """
+    with os.scandir(month_dir) as entries:
+        files = sum(1 for entry in entries if is_revision_file(entry.name))
+    return files + count_segment(month_dir)
+
+
+def month_state(month_dir: Path) -> tuple[int, int]:
+    """What a month's revisions depend on: directory mtime and index size."""
+    index_path = month_dir / SEGMENT_INDEX_NAME
+    index_size = index_path.stat().st_size if index_path.exists() else 0
+    return month_dir.stat().st_mtime_ns, index_size
+
+
+def page_months(page_dir: Path) -> dict[str, tuple[int, int]]:
+    """
+    The state of every month directory of a page, keyed "YYYY/MM", oldest
+    first. Months changed within MTIME_SLACK_NS are UNSETTLED.
+    """
+    if not page_dir.exists():
+        return {}
+    recent = time.time_ns() - MTIME_SLACK_NS
+    months = {}
+    for year_dir in date_dirs(page_dir):
+        for month_dir in date_dirs(year_dir):
+            state = month_state(month_dir)
+            months[f"{year_dir.name}/{month_dir.name}"] = (
+                state if state[0] < recent else UNSETTLED
+            )
+    return months
@@ -0,0 +1,138 @@
+"""Adaptive request rate limiting shared by all downloaders."""
+
+import asyncio
+import functools
+import threading
+import time
+from typing import NamedTuple
+
+THROTTLE_STATUSES = frozenset({429, 503})
+HOST_RATE = 5.0  # requests/sec a host starts at
+MIN_RATE = 0.2
+MAX_RATE = 50.0
+GLOBAL_RATE = 100.0
+TARGET_LATENCY = 5.0  # seconds to response headers before we back off
+
+
+class RateStats(NamedTuple):
+    rate: float
+    requests: int
+    throttled: int
+    achieved: float
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second with bursts of up to `rate`. Tokens
+    can go negative: each request reserves its slot and is told how long to
+    wait for it, so callers sleep without holding the lock.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        capacity = max(self.rate, 1.0)
+        elapsed = now - self.updated
+        self.tokens = min(capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdaptiveRateLimiter:
+    """
+    One token bucket per host plus a global one. Host rates adapt AIMD-style:
+    every successful response adds about `increase` requests/sec per second
+    of traffic. A 429/503 or a connection failure cuts the rate by 30%, and
+    a response slower than target_latency by 10%. Cuts are at most
+    one per `cooldown` seconds, since concurrent requests tend to be
+    throttled together and should count as one signal. Requests and
+    throttled responses are counted per host, to report achieved rates.
+    """
+
+    def __init__(
+        self,
+        host_rate: float = HOST_RATE,
+        global_rate: float = GLOBAL_RATE,
+        min_rate: float = MIN_RATE,
+        max_rate: float = MAX_RATE,
+        increase: float = 0.5,
+        decrease: float = 0.7,
+        target_latency: float = TARGET_LATENCY,
+        cooldown: float = 1.0,
+    ):
+        self.host_rate = host_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.started = time.monotonic()
+        self._global = TokenBucket(global_rate)
+        self._hosts = {}
+        self._requests = {}
+        self._throttled = {}
+        self._last_cut = {}
+        self._lock = threading.Lock()
+
+    def _delay(self, host: str) -> float:
+        with self._lock:
+            bucket = self._hosts.setdefault(host, TokenBucket(self.host_rate))
+            self._requests[host] = self._requests.get(host, 0) + 1
+            now = time.monotonic()
+            return max(bucket.reserve(now), self._global.reserve(now))
+
+    def wait(self, host: str) -> None:
+        """Blocks until the next request to host may be sent."""
+        delay = self._delay(host)
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self, host: str) -> None:
+        delay = self._delay(host)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def record(self, host: str, status: int | None, latency: float) -> None:
+        """
+        Adapts the host's rate to how a request went. status is None when
+        the request failed without a response.
+        """
+        with self._lock:
+            bucket = self._hosts.setdefault(host, TokenBucket(self.host_rate))
+            throttled = status is None or status in THROTTLE_STATUSES
+            if throttled:
+                self._throttled[host] = self._throttled.get(host, 0) + 1
+            if throttled or latency > self.target_latency:
+                now = time.monotonic()
+                if now - self._last_cut.get(host, 0.0) < self.cooldown:
+                    return
+                self._last_cut[host] = now
+                rate = bucket.rate * (self.decrease if throttled else 0.9)
+            else:
+                rate = bucket.rate + self.increase / bucket.rate
+            bucket.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def stats(self) -> dict[str, RateStats]:
+        """Current rate, request counts and achieved requests/sec per host."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self._lock:
+            return {
+                host: RateStats(
+                    rate=bucket.rate,
+                    requests=self._requests.get(host, 0),
+                    throttled=self._throttled.get(host, 0),
+                    achieved=self._requests.get(host, 0) / elapsed,
+                )
+                for host, bucket in self._hosts.items()
+            }
+
+
+@functools.cache
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """The process-wide limiter every downloader shares."""
+    return AdaptiveRateLimiter()
@@ -0,0 +1,238 @@
+"""
+An SQLite index of the revisions stored under a data directory: one row of
+metadata per revision, plus the state every month directory was last
+indexed at (see page_manifest). Existence checks, counts and the first and
+last revision of a page are answered from it. revision_store brings a page
+up to date with the disk before using it, listing only the months that
+changed.
+"""
+
+import atexit
+import functools
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from utils.export_stream import RevisionRecord, format_timestamp
+from utils.page_manifest import UNSETTLED
+
+INDEX_NAME = "revisions.sqlite"
+FLUSH_ROWS = 1000  # rows of new revisions written in one transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    page TEXT NOT NULL,
+    lang TEXT,
+    revision_id INTEGER NOT NULL,
+    parent_id INTEGER,
+    timestamp TEXT NOT NULL,
+    user TEXT,
+    size INTEGER,
+    sha1 TEXT,
+    path TEXT NOT NULL,
+    PRIMARY KEY (page, revision_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS revisions_by_time
+    ON revisions (page, timestamp, revision_id);
+-- The state of each month directory when its revisions were last indexed
+CREATE TABLE IF NOT EXISTS months (
+    page TEXT NOT NULL,
+    month TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    index_size INTEGER NOT NULL,
+    PRIMARY KEY (page, month)
+) WITHOUT ROWID;
+"""
+
+REPLACE = "INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# A month is "YYYY/MM", as its directory; its revisions are those whose
+# timestamp starts with "YYYY-MM-", as revision_path puts them there
+IN_MONTH = "page = ? AND timestamp GLOB replace(?, '/', '-') || '-*'"
+
+
+def _row(page: str, record: RevisionRecord, path: str, lang: str | None) -> tuple:
+    return (
+        page,
+        lang,
+        int(record.revision_id),
+        int(record.parent_id) if record.parent_id else None,
+        format_timestamp(record.timestamp),
+        record.user,
+        record.size,
+        record.sha1,
+        path,
+    )
+
+
+class RevisionIndex:
+    """
+    One row per stored revision, keyed by page and revision id, with paths
+    relative to the data directory. Timestamps are kept in the export
+    format, which sorts chronologically.
+
+    The revision ids of the pages being written are kept in memory, so
+    checking whether a revision is stored costs no query. New rows are
+    written FLUSH_ROWS at a time and before any query; rows lost to a crash
+    are found on disk the next time the page is synced. The connection is
+    shared by all threads of a process behind a lock.
+    """
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = data_dir
+        data_dir.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            data_dir / INDEX_NAME, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._pending = []
+        atexit.register(self.flush)
+
+    def _flush(self) -> None:
+        """
+        Writes the pending rows, and an unsettled state for months that have
+        none, so that a sync notices if they are deleted. Call with the lock
+        held.
+        """
+        if self._pending:
+            months = {(row[0], f"{row[4][:4]}/{row[4][5:7]}") for row in self._pending}
+            with self._connection:
+                self._connection.executemany(REPLACE, self._pending)
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO months VALUES (?, ?, ?, ?)",
+                    [(page, month, *UNSETTLED) for page, month in months],
+                )
+            self._pending = []
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _query(self, sql: str, *params: object) -> list[tuple]:
+        with self._lock:
+            self._flush()
+            return self._connection.execute(sql, params).fetchall()
+
+    def month_states(self, page: str) -> dict[str, tuple[int, int]]:
+        """The state each month of a page was last indexed at."""
+        rows = self._query(
+            "SELECT month, mtime_ns, index_size FROM months WHERE page = ?", page
+        )
+        return {month: (mtime_ns, index_size) for month, mtime_ns, index_size in rows}
+
+    def month_ids(self, page: str, month: str) -> set[str]:
+        """The indexed revision ids of one month of a page."""
+        rows = self._query(
+            f"SELECT revision_id FROM revisions WHERE {IN_MONTH}", page, month
+        )
+        return {str(revision_id) for (revision_id,) in rows}
+
+    def update_month(
+        self,
+        page: str,
+        month: str,
+        state: tuple[int, int],
+        removed: Iterable[str],
+        stored: Iterable[tuple[RevisionRecord, str]],
+    ) -> None:
+        """
+        Brings one month up to date with the disk: drops the rows of the
+        removed revision ids, indexes the (record, path) pairs found on disk
+        and records the state the month was listed at.
+        """
+        removed = [int(revision_id) for revision_id in removed]
+        stored = list(stored)
+        with self._lock, self._connection:
+            self._flush()
+            self._connection.executemany(
+                "DELETE FROM revisions WHERE page = ? AND revision_id = ?",
+                [(page, revision_id) for revision_id in removed],
+            )
+            self._connection.executemany(
+                REPLACE, [_row(page, record, path, None) for record, path in stored]
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)",
+                (page, month, *state),
+            )
+            ids = self._ids.get(page)
+            if ids is not None:
+                ids.difference_update(str(revision_id) for revision_id in removed)
+                ids.update(record.revision_id for record, _ in stored)
+
+    def drop_month(self, page: str, month: str) -> None:
+        """Forgets a month, for when its directory has been deleted."""
+        with self._lock, self._connection:
+            self._flush()
+            removed = self._connection.execute(
+                f"SELECT revision_id FROM revisions WHERE {IN_MONTH}", (page, month)
+            ).fetchall()
+            self._connection.execute(
+                f"DELETE FROM revisions WHERE {IN_MONTH}", (page, month)
+            )
+            self._connection.execute(
+                "DELETE FROM months WHERE page = ? AND month = ?", (page, month)
+            )
+            ids = self._ids.get(page)
+            if ids is not None:
+                ids.difference_update(str(revision_id) for (revision_id,) in removed)
+
+    def contains(self, page: str, revision_id: str) -> bool:
+        with self._lock:
+            ids = self._ids.get(page)
+            if ids is None:
+                self._flush()
+                rows = self._connection.execute(
+                    "SELECT revision_id FROM revisions WHERE page = ?", (page,)
+                )
+                ids = self._ids[page] = {str(revision_id) for (revision_id,) in rows}
+            return revision_id in ids
+
+    def add(
+        self, page: str, record: RevisionRecord, path: str, lang: str | None = None
+    ) -> None:
+        """Indexes a revision once it is stored."""
+        with self._lock:
+            self._pending.append(_row(page, record, path, lang))
+            ids = self._ids.get(page)
+            if ids is not None:
+                ids.add(record.revision_id)
+            if len(self._pending) >= FLUSH_ROWS:
+                self._flush()
+
+    def month_counts(self, page: str) -> dict[tuple[str, str], int]:
+        """Indexed revisions per (year, month) of a page, oldest first."""
+        rows = self._query(
+            "SELECT substr(timestamp, 1, 4), substr(timestamp, 6, 2), COUNT(*)"
+            " FROM revisions WHERE page = ? GROUP BY 1, 2 ORDER BY 1, 2",
+            page,
+        )
+        return {(year, month): count for year, month, count in rows}
+
+    def bound(self, page: str, last: bool) -> tuple[str, str, str] | None:
+        """(revision id, timestamp, path) of the oldest or newest revision."""
+        order = "DESC" if last else "ASC"
+        rows = self._query(
+            "SELECT revision_id, timestamp, path FROM revisions WHERE page = ?"
+            f" ORDER BY timestamp {order}, revision_id {order} LIMIT 1",
+            page,
+        )
+        if not rows:
+            return None
+        revision_id, timestamp, path = rows[0]
+        return str(revision_id), timestamp, path
+
+
+@functools.cache
+def _open_index(data_dir: Path) -> RevisionIndex:
+    return RevisionIndex(data_dir)
+
+
+@functools.cache
+def revision_index(data_dir: Path) -> RevisionIndex:
+    """The process-wide index of a data directory, however it is spelled."""
+    return _open_index(data_dir.resolve())
@@ -0,0 +1,500 @@
+"""
+Writing revisions into the <page>/<year>/<month>/<revision_id>.xml layout,
+or packed into one segment per month, optionally compressed and with their
+text deduplicated or delta-encoded, and reading them back whatever layout,
+codec and text store they use.
+"""
+
+import gzip
+import hashlib
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+from collections.abc import Generator
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from lxml import etree
+
+from utils.delta_store import ARCHIVE_NAME as DELTA_ARCHIVE_NAME
+from utils.delta_store import delta_archive
+from utils.export_stream import (
+    RevisionRecord,
+    format_timestamp,
+    parse_timestamp,
+    revision_record,
+)
+from utils.page_manifest import (
+    MTIME_SLACK_NS,
+    UNSETTLED,
+    count_month,
+    date_dirs,
+    is_revision_file,
+    page_months,
+)
+from utils.revision_index import RevisionIndex, revision_index
+from utils.segment_store import (
+    SEGMENT_NAME,
+    append_segment,
+    iter_segment,
+    read_index,
+)
+from utils.zstd_dictionary import (
+    compress_for_page,
+    decompress_frame,
+    decompress_frames,
+)
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for the zstd codecs
+    zstandard = None
+
+# File suffix of each on-disk codec. zstd-dict compresses with a dictionary
+# trained per page and shares the suffix of zstd, as frames name their
+# dictionary.
+CODECS = {
+    "none": ".xml",
+    "gzip": ".xml.gz",
+    "zstd": ".xml.zst",
+    "zstd-dict": ".xml.zst",
+}
+SUFFIX_CODECS = {".gz": "gzip", ".zst": "zstd"}
+ZSTD_CODECS = ("zstd", "zstd-dict")
+DECODE_BATCH = 256  # revisions decompressed in one call
+REVISION_GLOB = "*.xml*"
+# "files" writes one file per revision, "segments" one segment per month
+LAYOUTS = ("files", "segments")
+# Where revision texts go: into the revision XML, deduplicated into
+# <data>/.blobs, or as deltas into <page>/texts.delta
+TEXT_STORES = ("inline", "blobs", "deltas")
+BLOB_DIR_NAME = ".blobs"
+TEXT_CONTENT = re.compile(rb"(<text\b[^>]*?)>(.*?)</text>", re.DOTALL)
+TEXT_REFERENCE = re.compile(rb'(<text\b[^>]*?) (blob|delta)="([^"]+)"/>')
+# Pages synced with their revision index in this process, and a lock per page
+_synced = set()
+_sync_locks = {}
+_sync_locks_lock = threading.Lock()
+SHA1_KEY = re.compile(r"[0-9a-z]+")
+
+
+class StoredRevision(NamedTuple):
+    """Where a stored revision lives and when it was made."""
+
+    revision_id: str
+    timestamp: datetime
+    path: Path
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError("The zstd codec needs the zstandard package installed")
+
+
+def compress(data: bytes, codec: str, page_dir: Path | None = None) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data, mtime=0)
+    if codec == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdCompressor().compress(data)
+    if codec == "zstd-dict":
+        _require_zstandard()
+        return compress_for_page(data, page_dir, stored_samples)
+    return data
+
+
+def decode(data: bytes, codec: str, page_dir: Path | None = None) -> bytes:
+    """Decodes stored bytes; zstd frames may need their page's dictionary."""
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec in ZSTD_CODECS:
+        _require_zstandard()
+        return decompress_frame(data, page_dir)
+    return data
+
+
+def decode_batch(items: list[tuple[bytes, str]], page_dir: Path) -> list[bytes]:
+    """Decodes (data, codec) pairs of one page, the zstd frames in one call."""
+    frames = [data for data, codec in items if codec in ZSTD_CODECS]
+    if frames:
+        _require_zstandard()
+        frames = iter(decompress_frames(frames, page_dir))
+    return [
+        next(frames) if codec in ZSTD_CODECS else decode(data, codec)
+        for data, codec in items
+    ]
+
+
+def codec_from_path(path: Path) -> str:
+    return SUFFIX_CODECS.get(path.suffix, "none")
+
+
+def decompress(data: bytes, path: Path) -> bytes:
+    """Decodes a revision file of <page>/<year>/<month>/ by its suffix."""
+    return decode(data, codec_from_path(path), path.parents[2])
+
+
+def revision_id_from_path(path: Path) -> str:
+    return path.name.split(".", 1)[0]
+
+
+def revision_path(
+    record: RevisionRecord, page_name: str, save_dir: Path, codec: str = "none"
+) -> Path:
+    """Returns where a revision lives on disk."""
+    year = str(record.timestamp.year)
+    month = str(record.timestamp.month).zfill(2)
+    return save_dir / page_name / year / month / f"{record.revision_id}{CODECS[codec]}"
+
+
+def store_text_blob(record: RevisionRecord, save_dir: Path, codec: str) -> bytes:
+    """
+    Moves a revision's text into <save_dir>/.blobs, keyed by the sha1 the
+    export gives for it, and returns the revision XML with the text replaced
+    by a reference. Identical texts, as left by reverts, are stored once.
+    """
+    match = TEXT_CONTENT.search(record.xml)
+    if match is None or not match.group(2):  # empty or deleted text
+        return record.xml
+    content = match.group(2)
+    key = record.sha1
+    if not key or not SHA1_KEY.fullmatch(key):
+        key = hashlib.sha1(content).hexdigest()
+    # Blobs are shared between pages, so they cannot use a page's dictionary
+    codec = "zstd" if codec == "zstd-dict" else codec
+    reference = f"{key[:2]}/{key}{CODECS[codec].removeprefix('.xml')}"
+    blob_path = save_dir / BLOB_DIR_NAME / reference
+    if not blob_path.exists():
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=blob_path.parent, suffix=".tmp", delete=False
+        ) as tmp:
+            tmp.write(compress(content, codec))
+        Path(tmp.name).replace(blob_path)
+    stub = match.group(1) + f' blob="{reference}"/>'.encode()
+    return record.xml[: match.start()] + stub + record.xml[match.end() :]
+
+
+def store_text_delta(record: RevisionRecord, page_dir: Path) -> bytes:
+    """
+    Appends a revision's text to the page's delta archive and returns the
+    revision XML with the text replaced by a reference to it.
+    """
+    match = TEXT_CONTENT.search(record.xml)
+    if match is None or not match.group(2):
+        return record.xml
+    delta_archive(page_dir).append(record.revision_id, match.group(2).decode())
+    stub = match.group(1) + f' delta="{record.revision_id}"/>'.encode()
+    return record.xml[: match.start()] + stub + record.xml[match.end() :]
+
+
+def resolve_text(xml: bytes, page_dir: Path) -> bytes:
+    """
+    Puts the text back into revision XML written with store_text_blob or
+    store_text_delta.
+    """
+    if b' blob="' not in xml and b' delta="' not in xml:
+        return xml
+    match = TEXT_REFERENCE.search(xml)
+    if match is None:
+        return xml
+    reference = match.group(3).decode()
+    if match.group(2) == b"blob":
+        blob_path = page_dir.parent / BLOB_DIR_NAME / reference
+        content = decode(blob_path.read_bytes(), codec_from_path(blob_path))
+    else:
+        content = delta_archive(page_dir).content(reference)
+        if content is None:
+            raise ValueError(
+                f"Revision text {reference} is missing from {page_dir / DELTA_ARCHIVE_NAME}"
+            )
+        content = content.encode()
+    text = match.group(1) + b">" + content + b"</text>"
+    return xml[: match.start()] + text + xml[match.end() :]
+
+
+def write_revision(
+    record: RevisionRecord,
+    page_name: str,
+    save_dir: Path,
+    codec: str = "none",
+    layout: str = "files",
+    lang: str | None = None,
+    text_store: str = "inline",
+) -> bool:
+    """
+    Writes a revision unless the data directory's revision index holds it,
+    in either layout, and then indexes it. The index is synced with the disk
+    the first time a page is written in a process, see page_index.
+    With text_store "blobs" or "deltas", the text goes to the blob store or
+    the page's delta archive and the revision only references it.
+    Returns True if written.
+    """
+    index = page_index(save_dir / page_name)
+    if index.contains(page_name, record.revision_id):
+        return False
+    xml = record.xml
+    if text_store == "blobs":
+        xml = store_text_blob(record, save_dir, codec)
+    elif text_store == "deltas":
+        xml = store_text_delta(record, save_dir / page_name)
+    data = compress(xml, codec, save_dir / page_name)
+    path = revision_path(record, page_name, save_dir, codec)
+    if layout == "segments":
+        path = path.parent / SEGMENT_NAME
+        written = append_segment(
+            path.parent,
+            record.revision_id,
+            format_timestamp(record.timestamp),
+            data,
+            codec,
+        )
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        written = True
+    index.add(page_name, record, _index_path(path), lang)
+    return written
+
+
+def iter_revision_files(month_dir: Path) -> list[Path]:
+    """The revision files of one month directory, in any codec."""
+    return sorted(month_dir.glob(REVISION_GLOB), key=revision_id_from_path)
+
+
+def read_revision_bytes(path: Path) -> bytes:
+    """A revision file's XML, decompressed and with its text resolved."""
+    # The page directory is two levels above <page>/<year>/<month>/<file>
+    return resolve_text(decompress(path.read_bytes(), path), path.parents[2])
+
+
+def read_revision_text(path: Path) -> str:
+    """Reads a stored revision as XML text, decompressing it if needed."""
+    return read_revision_bytes(path).decode("utf-8")
+
+
+def iter_month_revisions(month_dir: Path) -> Generator[tuple[str, bytes], None, None]:
+    """
+    Yields (revision_id, XML) for every revision of one month directory,
+    whether stored as files, in the month's segment or both.
+    """
+    page_dir = month_dir.parents[1]
+    stored = (
+        (revision_id_from_path(path), path.read_bytes(), codec_from_path(path))
+        for path in iter_revision_files(month_dir)
+    )
+    segment = (
+        (entry.revision_id, data, entry.codec)
+        for entry, data in iter_segment(month_dir)
+    )
+    # Decoded DECODE_BATCH at a time, so zstd frames are decompressed together
+    batch = []
+    for revision in itertools.chain(stored, segment):
+        batch.append(revision)
+        if len(batch) == DECODE_BATCH:
+            yield from _decode_revisions(batch, page_dir)
+            batch = []
+    yield from _decode_revisions(batch, page_dir)
+
+
+def stored_samples(page_dir: Path, limit: int) -> list[bytes]:
+    """
+    Up to limit stored revisions of a page, oldest months first, decoded but
+    with their text references left in, as they were when compressed.
+    """
+    samples = []
+    for month_dir in month_dirs(page_dir):
+        stored = itertools.chain(
+            (
+                (path.read_bytes(), codec_from_path(path))
+                for path in iter_revision_files(month_dir)
+            ),
+            ((data, entry.codec) for entry, data in iter_segment(month_dir)),
+        )
+        samples += decode_batch(
+            list(itertools.islice(stored, limit - len(samples))), page_dir
+        )
+        if len(samples) >= limit:
+            break
+    return samples
+
+
+def _decode_revisions(
+    batch: list[tuple[str, bytes, str]], page_dir: Path
+) -> list[tuple[str, bytes]]:
+    decoded = decode_batch([(data, codec) for _, data, codec in batch], page_dir)
+    return [
+        (revision_id, resolve_text(xml, page_dir))
+        for (revision_id, _, _), xml in zip(batch, decoded, strict=True)
+    ]
+
+
+def count_month_revisions(month_dir: Path) -> int:
+    """How many revisions a month directory holds, without reading any."""
+    return count_month(month_dir)
+
+
+def month_dirs(page_dir: Path) -> list[Path]:
+    """The <year>/<month> directories of a page, oldest first."""
+    if not page_dir.exists():
+        return []
+    return [
+        month_dir
+        for year_dir in date_dirs(page_dir)
+        for month_dir in date_dirs(year_dir)
+    ]
+
+
+def _index_path(path: Path) -> str:
+    """<page>/<year>/<month>/<file>, the path relative to the data directory."""
+    return "/".join(path.parts[-4:])
+
+
+def _stored_paths(month_dir: Path) -> dict[str, Path]:
+    """The revision ids on disk in a month, with the file or segment of each."""
+    with os.scandir(month_dir) as entries:
+        stored = {
+            entry.name.split(".", 1)[0]: month_dir / entry.name
+            for entry in entries
+            if is_revision_file(entry.name)
+        }
+    for entry in read_index(month_dir):
+        stored.setdefault(entry.revision_id, month_dir / SEGMENT_NAME)
+    return stored
+
+
+def _read_records(
+    month_dir: Path, paths: dict[str, Path]
+) -> Generator[tuple[RevisionRecord, str], None, None]:
+    """
+    Yields a record and index path for the given revisions of a month. Text
+    references are left in, as only the metadata is indexed. Files changed
+    within MTIME_SLACK_NS that cannot be read, as they may still be being
+    written, are skipped.
+    """
+    recent = time.time_ns() - MTIME_SLACK_NS
+    segment_ids = set()
+    for revision_id, path in paths.items():
+        if path.name == SEGMENT_NAME:
+            segment_ids.add(revision_id)
+            continue
+        try:
+            xml = decompress(path.read_bytes(), path)
+            record = revision_record(etree.fromstring(xml))
+        except Exception:
+            if path.stat().st_mtime_ns < recent:
+                raise
+            continue
+        yield record, _index_path(path)
+    if segment_ids:
+        segment_path = _index_path(month_dir / SEGMENT_NAME)
+        page_dir = month_dir.parents[1]
+        for entry, data in iter_segment(month_dir):
+            if entry.revision_id in segment_ids:
+                xml = decode(data, entry.codec, page_dir)
+                yield revision_record(etree.fromstring(xml)), segment_path
+
+
+def _sync_lock(page_dir: Path) -> threading.Lock:
+    with _sync_locks_lock:
+        return _sync_locks.setdefault(page_dir, threading.Lock())
+
+
+def _sync(index: RevisionIndex, page_dir: Path) -> None:
+    """sync_page with the page's sync lock held."""
+    page = page_dir.name
+    indexed = index.month_states(page)
+    on_disk = page_months(page_dir)
+    for month in indexed.keys() - on_disk.keys():
+        index.drop_month(page, month)
+    for month, state in on_disk.items():
+        if state != UNSETTLED and indexed.get(month) == state:
+            continue
+        month_dir = page_dir / month
+        stored = _stored_paths(month_dir)
+        known = index.month_ids(page, month)
+        new = {
+            revision_id: path
+            for revision_id, path in stored.items()
+            if revision_id not in known
+        }
+        records = list(_read_records(month_dir, new))
+        if len(records) < len(new):
+            # Skipped files are read by the next sync
+            state = UNSETTLED
+        index.update_month(
+            page,
+            month,
+            state,
+            removed=known - stored.keys(),
+            stored=records,
+        )
+    _synced.add(page_dir)
+
+
+def sync_page(page_dir: Path) -> RevisionIndex:
+    """
+    Brings a page's rows in the revision index up to date with the disk and
+    returns the index. Only months whose directory or segment index changed
+    since they were last indexed are listed, and only revisions that are not
+    indexed yet are read. A page stored before the index existed is read
+    once; the rows of deleted months and revisions are dropped.
+    """
+    index = revision_index(page_dir.parent)
+    with _sync_lock(page_dir):
+        _sync(index, page_dir)
+    return index
+
+
+def _needs_sync(page_dir: Path) -> bool:
+    return page_dir not in _synced or not page_dir.exists()
+
+
+def page_index(page_dir: Path) -> RevisionIndex:
+    """
+    The revision index of a page's data directory, synced with the disk the
+    first time the page is used in this process and again if its directory
+    was deleted. Other changes to the disk are picked up by the next sync,
+    as counts and first/last lookups do.
+    """
+    index = revision_index(page_dir.parent)
+    if _needs_sync(page_dir):
+        # Threads that waited for another one's sync do not repeat it
+        with _sync_lock(page_dir):
+            if _needs_sync(page_dir):
+                _sync(index, page_dir)
+    return index
+
+
+def count_page_revisions(page_dir: Path) -> int:
+    """Counts a page's stored revisions in the revision index."""
+    return sum(stored_month_counts(page_dir).values())
+
+
+def stored_month_counts(page_dir: Path) -> dict[tuple[str, str], int]:
+    """Stored revisions per (year, month) of a page, oldest first."""
+    return sync_page(page_dir).month_counts(page_dir.name)
+
+
+def _find_bound(page_dir: Path, last: bool) -> StoredRevision | None:
+    bound = sync_page(page_dir).bound(page_dir.name, last)
+    if bound is None:
+        return None
+    revision_id, timestamp, path = bound
+    return StoredRevision(
+        revision_id, parse_timestamp(timestamp), page_dir.parent / path
+    )
+
+
+def find_first_revision(page_dir: Path) -> StoredRevision | None:
+    """The oldest stored revision of a page: its id, timestamp and path."""
+    return _find_bound(page_dir, last=False)
+
+
+def find_last_revision(page_dir: Path) -> StoredRevision | None:
+    """The newest stored revision of a page: its id, timestamp and path."""
+    return _find_bound(page_dir, last=True)
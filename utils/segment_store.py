@@ -0,0 +1,141 @@
+"""
+Append-only segment files: every revision of one <page>/<year>/<month> packed
+into a single file, next to an index of where each revision's bytes start.
+
+The index is plain text, one tab separated line per revision. A revision's
+bytes are appended to the segment before its index line, so an interrupted
+write leaves at most some unreferenced bytes behind. Writes are serialised
+per month within a process; two processes must not write the same page.
+"""
+
+import threading
+from collections.abc import Generator
+from pathlib import Path
+from typing import NamedTuple
+
+SEGMENT_NAME = "revisions.seg"
+INDEX_NAME = "revisions.idx"
+MAX_CACHED_INDEXES = 64
+
+
+class SegmentEntry(NamedTuple):
+    """One index line: a revision and where its bytes are in the segment."""
+
+    revision_id: str
+    timestamp: str
+    offset: int
+    length: int
+    codec: str
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+# Revision ids of recently written indexes, keyed by index path, with the
+# index size they were read at so changes by anyone else are noticed
+_known_ids = {}
+
+
+def _month_lock(month_dir: Path) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(month_dir, threading.Lock())
+
+
+def _parse_index(data: bytes) -> tuple[int, list[SegmentEntry]]:
+    """
+    The complete entries of an index and the size they take up. A trailing
+    line without a newline is the remainder of an interrupted write.
+    """
+    complete = data[: data.rfind(b"\n") + 1]
+    entries = []
+    for line in complete.decode("utf-8").splitlines():
+        revision_id, timestamp, offset, length, codec = line.split("\t")
+        entries.append(
+            SegmentEntry(revision_id, timestamp, int(offset), int(length), codec)
+        )
+    return len(complete), entries
+
+
+def read_index(month_dir: Path) -> list[SegmentEntry]:
+    """The entries of a month's segment, in the order they were appended."""
+    index_path = month_dir / INDEX_NAME
+    if not index_path.exists():
+        return []
+    return _parse_index(index_path.read_bytes())[1]
+
+
+def count_segment(month_dir: Path) -> int:
+    """How many revisions a month's segment holds, without parsing the index."""
+    index_path = month_dir / INDEX_NAME
+    if not index_path.exists():
+        return 0
+    return index_path.read_bytes().count(b"\n")
+
+
+def _indexed_ids(month_dir: Path) -> set[str]:
+    """The revision ids in a month's index. Call with the month's lock held."""
+    index_path = month_dir / INDEX_NAME
+    size = index_path.stat().st_size if index_path.exists() else 0
+    cached = _known_ids.get(index_path)
+    if cached is not None and cached[0] == size:
+        return cached[1]
+    if size == 0:
+        return set()
+    valid_size, entries = _parse_index(index_path.read_bytes())
+    if valid_size != size:
+        with index_path.open("r+b") as index:
+            index.truncate(valid_size)
+    if len(_known_ids) >= MAX_CACHED_INDEXES:
+        _known_ids.clear()
+    ids = {entry.revision_id for entry in entries}
+    _known_ids[index_path] = (valid_size, ids)
+    return ids
+
+
+def segment_contains(month_dir: Path, revision_id: str) -> bool:
+    with _month_lock(month_dir):
+        return revision_id in _indexed_ids(month_dir)
+
+
+def append_segment(
+    month_dir: Path, revision_id: str, timestamp: str, data: bytes, codec: str
+) -> bool:
+    """
+    Appends a revision's (already encoded) bytes to a month's segment unless
+    the month already holds it. Returns True if written.
+    """
+    with _month_lock(month_dir):
+        ids = _indexed_ids(month_dir)
+        if revision_id in ids:
+            return False
+        month_dir.mkdir(parents=True, exist_ok=True)
+        with (month_dir / SEGMENT_NAME).open("ab") as segment:
+            offset = segment.tell()
+            segment.write(data)
+        index_path = month_dir / INDEX_NAME
+        fields = [revision_id, timestamp, str(offset), str(len(data)), codec]
+        with index_path.open("ab") as index:
+            index.write(("\t".join(fields) + "\n").encode("utf-8"))
+        ids.add(revision_id)
+        _known_ids[index_path] = (index_path.stat().st_size, ids)
+    return True
+
+
+def read_entry(month_dir: Path, entry: SegmentEntry) -> bytes:
+    """The encoded bytes of one revision."""
+    with (month_dir / SEGMENT_NAME).open("rb") as segment:
+        segment.seek(entry.offset)
+        return segment.read(entry.length)
+
+
+def iter_segment(month_dir: Path) -> Generator[tuple[SegmentEntry, bytes], None, None]:
+    """
+    Yields every entry of a month's segment with its encoded bytes, reading
+    the segment front to back through one open file.
+    """
+    entries = read_index(month_dir)
+    if not entries:
+        return
+    with (month_dir / SEGMENT_NAME).open("rb") as segment:
+        for entry in entries:
+            segment.seek(entry.offset)
+            yield entry, segment.read(entry.length)
@@ -0,0 +1,160 @@
+"""
+Per-page zstd dictionaries. Revisions of one article share nearly all their
+vocabulary and markup, so a dictionary trained on a sample of them lets
+zstd compress each revision as if it knew the rest of the page.
+
+A page's dictionary lives in <page>/zstd.dict. Frames record the id of the
+dictionary they were compressed with, so frames without one (written with
+the plain zstd codec, or before the page had a dictionary) stay readable.
+"""
+
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for the zstd codecs
+    zstandard = None
+
+DICT_NAME = "zstd.dict"
+DICT_SIZE = 112_640  # zstd's default dictionary size
+TRAIN_SAMPLES = 100  # revisions a page's dictionary is trained on
+LEVEL = 3
+MAX_PAGES = 64  # pages whose dictionaries or samples are kept in memory
+
+_lock = threading.Lock()
+_dictionaries = {}
+_samples = {}
+_untrainable = set()
+
+
+class PageDictionary:
+    """A loaded dictionary with the compressor and decompressor using it."""
+
+    def __init__(self, data: bytes):
+        self.dictionary = zstandard.ZstdCompressionDict(data)
+        self.dict_id = self.dictionary.dict_id()
+        self.lock = threading.Lock()
+        self.compressor = zstandard.ZstdCompressor(
+            level=LEVEL, dict_data=self.dictionary
+        )
+        self.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+
+
+def train_dictionary(samples: list[bytes], dict_size: int = DICT_SIZE) -> bytes:
+    """
+    Trains a dictionary on sample revisions. zstd needs the samples to be
+    several times larger than the dictionary, so it shrinks for small pages.
+    """
+    dict_size = min(dict_size, sum(len(sample) for sample in samples) // 10)
+    return zstandard.train_dictionary(dict_size, samples, level=LEVEL).as_bytes()
+
+
+def load_dictionary(page_dir: Path) -> PageDictionary | None:
+    """The page's dictionary, read once per process."""
+    with _lock:
+        if page_dir not in _dictionaries:
+            path = page_dir / DICT_NAME
+            if not path.exists():
+                return None
+            if len(_dictionaries) >= MAX_PAGES:
+                _dictionaries.clear()
+            _dictionaries[page_dir] = PageDictionary(path.read_bytes())
+        return _dictionaries[page_dir]
+
+
+def _save_dictionary(page_dir: Path, data: bytes) -> None:
+    """
+    Saves a freshly trained dictionary. If another writer saved one first,
+    frames may already use it, so that one is kept.
+    """
+    page_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with (page_dir / DICT_NAME).open("xb") as dictionary_file:
+            dictionary_file.write(data)
+    except FileExistsError:
+        pass
+
+
+def compress_for_page(
+    data: bytes,
+    page_dir: Path,
+    stored_samples: Callable[[Path, int], list[bytes]] | None = None,
+) -> bytes:
+    """
+    Compresses a revision with its page's dictionary. Until the page has
+    one, revisions are compressed without and kept as training samples; the
+    dictionary is trained once TRAIN_SAMPLES of them have been written.
+
+    stored_samples(page_dir, n) returns up to n revisions the page already
+    has on disk. It seeds the samples the first time a process sees the
+    page, so pages written over several runs get a dictionary too.
+    """
+    dictionary = load_dictionary(page_dir)
+    if dictionary is not None:
+        with dictionary.lock:
+            return dictionary.compressor.compress(data)
+    seeded = page_dir in _samples or page_dir in _untrainable
+    stored = (
+        []
+        if seeded or stored_samples is None
+        else stored_samples(page_dir, TRAIN_SAMPLES)
+    )
+    samples = None
+    with _lock:
+        if page_dir not in _untrainable:
+            if page_dir not in _samples:
+                if len(_samples) >= MAX_PAGES:
+                    # Forget the page sampled longest ago, most likely finished
+                    del _samples[next(iter(_samples))]
+                _samples[page_dir] = stored
+            _samples[page_dir].append(data)
+            if len(_samples[page_dir]) >= TRAIN_SAMPLES:
+                samples = _samples.pop(page_dir)
+    if samples is not None:
+        try:
+            _save_dictionary(page_dir, train_dictionary(samples))
+        except zstandard.ZstdError:
+            # Too little or too uniform data to learn from
+            with _lock:
+                _untrainable.add(page_dir)
+    return zstandard.ZstdCompressor(level=LEVEL).compress(data)
+
+
+def _frame_dictionary(dict_id: int, page_dir: Path | None) -> PageDictionary:
+    dictionary = load_dictionary(page_dir) if page_dir is not None else None
+    if dictionary is None or dictionary.dict_id != dict_id:
+        raise ValueError(f"No zstd dictionary {dict_id} in {page_dir}")
+    return dictionary
+
+
+def decompress_frame(frame: bytes, page_dir: Path | None = None) -> bytes:
+    """Decompresses a frame, with the page's dictionary if it was used."""
+    dict_id = zstandard.get_frame_parameters(frame).dict_id
+    if not dict_id:
+        return zstandard.ZstdDecompressor().decompress(frame)
+    dictionary = _frame_dictionary(dict_id, page_dir)
+    with dictionary.lock:
+        return dictionary.decompressor.decompress(frame)
+
+
+def decompress_frames(frames: list[bytes], page_dir: Path | None = None) -> list[bytes]:
+    """
+    Decompresses many frames of one page in one call, sharing the loaded
+    dictionary and spreading the work over all cores where zstandard's C
+    backend allows it.
+    """
+    dict_ids = {zstandard.get_frame_parameters(frame).dict_id for frame in frames}
+    if len(dict_ids) != 1 or 0 in dict_ids:
+        return [decompress_frame(frame, page_dir) for frame in frames]
+    dictionary = _frame_dictionary(dict_ids.pop(), page_dir)
+    try:
+        with dictionary.lock:
+            buffers = dictionary.decompressor.multi_decompress_to_buffer(
+                frames, threads=-1
+            )
+    except (NotImplementedError, zstandard.ZstdError):
+        # cffi backend, or frames that do not record their content size
+        return [decompress_frame(frame, page_dir) for frame in frames]
+    return [buffers[i].tobytes() for i in range(len(buffers))]
@@ -1,38 +1,34 @@
 import argparse
 from pathlib import Path
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree
 from tqdm import tqdm
 
-def parse_revision_xml(xml_content: str, include_text: bool = False) -> dict:
-    """Parse a single revision XML string into a dictionary."""
-    # Print the first 100 characters for inspection
+from utils.revision_store import count_month_revisions, iter_month_revisions, month_dirs
 
-    soup = BeautifulSoup(xml_content, "lxml-xml")
-    revision = soup.find("revision")
-    
+XML_PARSER = etree.XMLParser(huge_tree=True)
+
+def revision_fields(revision: etree._Element, include_text: bool = False) -> dict:
+    """Extract the DataFrame fields from a parsed <revision> element."""
     # Extract contributor information safely
-    contributor = revision.find("contributor")
-    if contributor:
-        username = contributor.find("username")
-        username = username.text if username else None
-        userid = contributor.find("id")
-        userid = userid.text if userid else None
+    contributor = revision.find("{*}contributor")
+    if contributor is not None:
+        username = contributor.findtext("{*}username")
+        userid = contributor.findtext("{*}id")
     else:
         username = None
         userid = None
     
     # Find text content
-    text_elem = revision.find("text")
-    text_content = text_elem.text if text_elem else ""
+    text_content = revision.findtext("{*}text") or ""
     
     # Extract basic revision information
     data = {
-        'revision_id': revision.find("id").text if revision.find("id") else None,
-        'timestamp': revision.find("timestamp").text if revision.find("timestamp") else None,
+        'revision_id': revision.findtext("{*}id"),
+        'timestamp': revision.findtext("{*}timestamp"),
         'username': username,
         'userid': userid,
-        'comment': revision.find("comment").text if revision.find("comment") else None,
+        'comment': revision.findtext("{*}comment"),
         'text_length': len(text_content)
     }
     
@@ -42,50 +38,55 @@ def parse_revision_xml(xml_content: str, include_text: bool = False) -> dict:
     
     return data
 
+def parse_revision_xml(xml_content: str, include_text: bool = False) -> dict:
+    """Parse a single revision XML string into a dictionary."""
+    revision = etree.fromstring(xml_content.encode("utf-8"), XML_PARSER)
+    return revision_fields(revision, include_text)
+
+def build_dataframe(dataframes: list[pd.DataFrame]) -> pd.DataFrame:
+    """Combine batches of revision rows into one DataFrame, newest first."""
+    final_df = pd.concat(dataframes, ignore_index=True)
+    final_df['timestamp'] = pd.to_datetime(final_df['timestamp'])
+    return final_df.sort_values('timestamp', ascending=False)
+
 def process_article_directory(article_dir: Path, batch_size: int = 1000, include_text: bool = False) -> pd.DataFrame:
     """Process all revisions for an article into a single DataFrame."""
-    # Collect all XML files for this article
-    xml_files = []
-    for year_dir in article_dir.iterdir():
-        if not year_dir.is_dir():
-            continue
-        for month_dir in year_dir.iterdir():
-            if not month_dir.is_dir():
-                continue
-            xml_files.extend(month_dir.glob("*.xml"))
+    # Collect the month directories for this article; their revisions may be
+    # separate files or packed into a segment
+    months = month_dirs(article_dir)
+    total = sum(count_month_revisions(month_dir) for month_dir in months)
     
-    if not xml_files:
+    if not total:
         return None
     
-    # Process files in batches
+    # Process revisions in batches
     dataframes = []
-    for i in tqdm(range(0, len(xml_files), batch_size),
-                 desc=f"Processing {article_dir.name}",
-                 unit="batch"):
-        batch = xml_files[i:i + batch_size]
-        revision_data = []
-        
-        for file_path in batch:
-            try:
-                xml_content = file_path.read_text()
-                data = parse_revision_xml(xml_content, include_text)
-                # Add file path information
-                data['year'] = file_path.parent.parent.name
-                data['month'] = file_path.parent.name
-                revision_data.append(data)
-            except Exception as e:
-                print(f"Error processing {file_path}: {str(e)}")
-        
-        if revision_data:
-            dataframes.append(pd.DataFrame(revision_data))
+    revision_data = []
+    with tqdm(total=total, desc=f"Processing {article_dir.name}", unit="rev") as progress:
+        for month_dir in months:
+            for revision_id, xml_bytes in iter_month_revisions(month_dir):
+                try:
+                    data = parse_revision_xml(xml_bytes.decode("utf-8"), include_text)
+                    # Add the year and month from the directory layout
+                    data['year'] = month_dir.parent.name
+                    data['month'] = month_dir.name
+                    revision_data.append(data)
+                except Exception as e:
+                    print(f"Error processing revision {revision_id} in {month_dir}: {str(e)}")
+                progress.update()
+                
+                if len(revision_data) >= batch_size:
+                    dataframes.append(pd.DataFrame(revision_data))
+                    revision_data = []
+    
+    if revision_data:
+        dataframes.append(pd.DataFrame(revision_data))
     
     if not dataframes:
         return None
     
     # Combine all batches and sort
-    final_df = pd.concat(dataframes, ignore_index=True)
-    final_df['timestamp'] = pd.to_datetime(final_df['timestamp'])
-    return final_df.sort_values('timestamp', ascending=False)
+    return build_dataframe(dataframes)
 
 def print_summary(df: pd.DataFrame, article_name: str, include_text: bool):
     """Print summary statistics for an article's DataFrame."""
@@ -110,7 +111,8 @@ def main(data_dir: Path, output_dir: Path, batch_size: int = 1000, include_text:
     print(f"Processing with {'text content' if include_text else 'text length only'}")
     
     for article_dir in data_dir.iterdir():
-        if not article_dir.is_dir():
+        # Skip non-article directories such as .http_cache
+        if not article_dir.is_dir() or article_dir.name.startswith("."):
             continue
         
         df = process_article_directory(article_dir, batch_size, include_text)
@@ -143,7 +145,7 @@ if __name__ == "__main__":
         "--batch-size",
         type=int,
         default=1000,
-        help="Number of files to process in each batch",
+        help="Number of revisions to process in each batch",
     )
     parser.add_argument(
         "--include-text",